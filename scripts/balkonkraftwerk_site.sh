@@ -0,0 +1,8 @@
+# The balcony plant and the Offgridtech 195W on one site. The sun track
+# is computed once for both arrays.
+
+mkdir -p $SOLAR_PROPHET_STORE_DIR/plot && mkdir -p $SOLAR_PROPHET_STORE_DIR/csv &&\
+    python3 ../solar_prophet.py \
+	    --site balkonkraftwerk_site.toml \
+	    --plot $SOLAR_PROPHET_STORE_DIR/plot \
+	    --csv $SOLAR_PROPHET_STORE_DIR/csv $1
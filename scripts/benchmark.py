@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+
+__doc__="""
+Benchmarks the stages of solar_prophet.py with the configurations of
+the scripts as fixtures. Compares with a baseline and fails on
+regressions. Checks the parity of the numpy engine with pysolar
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os, sys
+import shlex
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(SCRIPTS_DIR))
+
+import solar_prophet as sp
+
+logging.basicConfig(level=logging.INFO)
+# solar_prophet logs with the name of the script which is silenced below
+logger = logging.getLogger(os.path.splitext(os.path.basename(sys.argv[0]))[0])
+
+STAGES = ('sun', 'panel_power', 'summarize', 'save_csv', 'save_plot', 'year')
+DAYS = ('2024-06-21', '2024-12-21')
+# A day of each month with the equinoxes, the solstices and the DST changes
+PARITY_DAYS = ('2024-01-15', '2024-02-15', '2024-03-20', '2024-03-31', '2024-04-15',
+               '2024-05-15', '2024-06-21', '2024-07-15', '2024-08-15', '2024-09-22',
+               '2024-10-27', '2024-11-15', '2024-12-21')
+YEAR = '2024'
+
+# The tolerances of the numpy engine documented in the README
+PARITY_ALTITUDE = 0.02 # deg
+PARITY_AZIMUTH = 0.05 # deg below 85° altitude
+PARITY_RADIATION = 1.0 # W/m²
+PARITY_POWER = 0.005 # of the maximum power
+
+# The noise of the fast stages is not a regression
+SLACK_SECONDS = 0.005
+# The key of the calibration seconds in the baseline
+CALIBRATION = 'calibration'
+SLACK_PEAK = 2**20
+
+
+def load_fixtures(scripts_dir = SCRIPTS_DIR):
+    """ The arguments of the scripts calling solar_prophet.py without
+    output directories and forecast day """
+    fixtures = {}
+    for script in sorted(glob.glob(os.path.join(scripts_dir, '*.sh'))):
+        with open(script) as f:
+            text = f.read().replace('\\\n', ' ')
+        for line in text.splitlines():
+            if 'solar_prophet.py' not in line or line.lstrip().startswith('#'):
+                continue
+            words = shlex.split(line.split('solar_prophet.py', 1)[1])
+            argv = []
+            while len(words) > 0:
+                word = words.pop(0)
+                if word in ('--plot', '--csv'):
+                    words.pop(0)
+                elif word.startswith('$'):
+                    continue
+                elif os.path.isfile(os.path.join(scripts_dir, word)):
+                    argv.append(os.path.join(scripts_dir, word))
+                else:
+                    argv.append(word)
+            fixtures[os.path.splitext(os.path.basename(script))[0]] = argv
+    return fixtures
+
+
+def get_args(argv):
+    args = sp.parse_arguments(argv)
+    if sp.check_arguments(args) > 0:
+        raise ValueError(f'Invalid fixture arguments "{argv}"')
+    return args
+
+
+def measure(function, repeat = 3):
+    """ The best wall time of the repeats and the peak of the allocated
+    memory of one more run """
+    times = []
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - begin)
+
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(times), peak
+
+
+def calibrate(repeat = 5):
+    """ The best seconds of a fixed Python and numpy loop. The times
+    divided by it compare between machines """
+    values = np.random.default_rng(0).random(2**16)
+    def loop():
+        total = 0.0
+        for value in values[:2**14].tolist():
+            total += value*value
+        for _ in range(20):
+            total += np.sort(values)[0] + np.cumsum(values)[-1]
+        return total
+    return measure(loop, repeat)[0]
+
+
+def set_ratios(results, calibration):
+    """ Adds the seconds relative to the calibration loop """
+    for stages in results.values():
+        for result in stages.values():
+            result['ratio'] = result['seconds'] / calibration
+
+
+def bench_fixture(argv, directory, stages = STAGES, repeat = 3):
+    """ The time, peak memory and days per second of the stages """
+    results = {}
+    for day in DAYS if set(stages) - {'year'} else ():
+        args = get_args(argv + [day])
+        stamps = sp.get_day_stamps(args.forecast_day)
+        pp = sp.get_panel_power(args, args.forecast_day)
+        plot_args = (args.lat, args.lon, sp.get_array_values(args, 'direction'),
+                     sp.get_array_values(args, 'slope'), sp.get_array_values(args, 'area'))
+
+        functions = {'sun': lambda: sp.get_sun_minutes(args.lat, args.lon, stamps, args.engine),
+                  'panel_power': lambda: sp.get_panel_power(args, args.forecast_day),
+                  'summarize': pp.summarize,
+                  'save_csv': lambda: pp.save_csv(os.path.join(directory, 'bench.csv')),
+                  'save_plot': lambda: pp.save_plot(*plot_args, os.path.join(directory, 'bench.png'))}
+        for stage, function in functions.items():
+            if stage not in stages:
+                continue
+            seconds, peak = measure(function, repeat)
+            result = results.setdefault(stage, {'seconds': 0.0, 'peak': 0, 'days': 0})
+            result['seconds'] += seconds
+            result['peak'] = max(result['peak'], peak)
+            result['days'] += 1
+
+    if 'year' in stages:
+        args = get_args(argv + ['--year', YEAR, '--jobs', '1'])
+        days = sp.get_forecast_days(args)
+        seconds, peak = measure(lambda: [pp.summarize() for pp in sp.get_panel_powers(args, days)], 1)
+        results['year'] = {'seconds': seconds, 'peak': peak, 'days': len(days)}
+
+    for result in results.values():
+        result['days_per_second'] = result['days'] / result['seconds']
+    return results
+
+
+def check_parity(argv):
+    """ The largest deviations of the numpy engine from pysolar """
+    deviations = {'altitude': 0.0, 'azimuth': 0.0, 'radiation': 0.0, 'power': 0.0}
+    for day in PARITY_DAYS:
+        pps = [sp.get_panel_power(get_args(argv + ['--engine', engine, day]), sp.ymd2date(day))
+               for engine in sp.SUN_ENGINES]
+        index = pps[0].df.index.intersection(pps[1].df.index)
+        dfs = [pp.df.loc[index] for pp in pps]
+        low = dfs[1].altitude < 85
+        # The minute the system barrier is passed may differ within the altitude tolerance
+        harvest = (dfs[0].tot_w > 0) & (dfs[1].tot_w > 0)
+        deviations['altitude'] = max(deviations['altitude'],
+                                     (dfs[0].altitude - dfs[1].altitude).abs().max())
+        deviations['azimuth'] = max(deviations['azimuth'],
+                                    (dfs[0].azimuth - dfs[1].azimuth)[low].abs().max())
+        deviations['radiation'] = max(deviations['radiation'],
+                                      (dfs[0].sunrads - dfs[1].sunrads).abs().max())
+        deviations['power'] = max(deviations['power'],
+                                  (dfs[0].tot_w - dfs[1].tot_w)[harvest].abs().max() / max(dfs[1].tot_w.max(), 1))
+
+    tolerances = {'altitude': PARITY_ALTITUDE, 'azimuth': PARITY_AZIMUTH,
+                  'radiation': PARITY_RADIATION, 'power': PARITY_POWER}
+    return deviations, all(deviations[key] <= tolerances[key] for key in tolerances)
+
+
+def get_regressions(results, baseline, calibration, threshold, memory_threshold):
+    """ The fixture stages slower or larger than the baseline beyond the
+    thresholds. The times are compared relative to the calibration loop of
+    each run, so a baseline of another machine holds """
+    regressions = []
+    slack = SLACK_SECONDS / calibration
+    for fixture, stages in results.items():
+        for stage, result in stages.items():
+            base = baseline.get(fixture, {}).get(stage)
+            if base is None or 'ratio' not in base:
+                continue
+            if result['ratio'] > base['ratio']*(1 + threshold/100) + slack:
+                regressions.append(f'"{fixture}/{stage}", Time:"{result["seconds"]:.3f}s",'
+                                   f' Ratio:"{result["ratio"]:.2f}",'
+                                   f' Baseline:"{base["ratio"]:.2f}"')
+            if result['peak'] > base['peak']*(1 + memory_threshold/100) + SLACK_PEAK:
+                regressions.append(f'"{fixture}/{stage}", Peak:"{result["peak"]/2**20:.1f}MB",'
+                                   f' Baseline:"{base["peak"]/2**20:.1f}MB"')
+    return regressions
+
+
+def parse_arguments():
+    """Parse command line arguments"""
+
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(sys.argv[0]),
+        description='Benchmarks the stages of solar_prophet.py with the scripts as fixtures',
+        epilog=__doc__)
+
+    parser.add_argument('--fixture', action = 'append', default = None,
+                        help = 'The script names to benchmark. All by default')
+
+    parser.add_argument('--stage', action = 'append', choices = STAGES, default = None,
+                        help = 'The stages to benchmark. All by default')
+
+    parser.add_argument('--repeat', type = int, default = 3,
+                        help = 'The number of runs of a stage. The best time counts')
+
+    parser.add_argument('--baseline', default = os.path.join(SCRIPTS_DIR, 'benchmark_baseline.json'),
+                        help = 'The JSON file with the results to compare to')
+
+    parser.add_argument('--save_baseline', action = 'store_true', dest='save_baseline',
+                        help = 'Save the results as the new baseline')
+
+    parser.add_argument('--threshold', type = float, default = 25.0,
+                        help = 'The allowed increase of the time over the baseline [%%]')
+
+    parser.add_argument('--memory_threshold', type = float, default = 10.0,
+                        help = 'The allowed increase of the peak memory over the baseline [%%]')
+
+    parser.add_argument('--parity', action = 'store_true', dest='parity',
+                        help = 'Check the parity of the numpy engine with pysolar')
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    sp.logger.setLevel(logging.WARNING)
+
+    fixtures = load_fixtures()
+    if args.fixture is not None:
+        unknown = set(args.fixture) - set(fixtures)
+        if len(unknown) > 0:
+            logger.error(f'The fixtures are unknown "{", ".join(sorted(unknown))}"')
+            return 1
+        fixtures = {name: fixtures[name] for name in args.fixture}
+
+    calibration = calibrate()
+    logger.info(f'Calibration # Time:"{calibration:.3f}s"')
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name, argv in fixtures.items():
+            try:
+                results[name] = bench_fixture(argv, directory, args.stage or STAGES, args.repeat)
+            except ValueError as e:
+                logger.error(f'The fixture is skipped "{name}": {e}')
+                continue
+            for stage, result in results[name].items():
+                text = f'Bench # "{name}/{stage}",'
+                text += f' Time:"{result["seconds"]:.3f}s",'
+                text += f' Peak:"{result["peak"]/2**20:.1f}MB",'
+                text += f' Rate:"{result["days_per_second"]:.1f}days/s"'
+                logger.info(text)
+    set_ratios(results, calibration)
+
+    errcode = 0
+    if args.parity:
+        for name in results:
+            argv = fixtures[name]
+            try:
+                deviations, ok = check_parity(argv)
+            except ImportError as e:
+                logger.info(f'Parity # pysolar not available: {e}')
+                break
+            text = f'Parity # "{name}",'
+            text += f' Altitude:"{deviations["altitude"]:.4f}°",'
+            text += f' Azimuth:"{deviations["azimuth"]:.4f}°",'
+            text += f' Radiation:"{deviations["radiation"]:.2f}W/m²",'
+            text += f' Power:"{100*deviations["power"]:.3f}%"'
+            if ok:
+                logger.info(text)
+            else:
+                logger.error(text)
+                errcode = 2
+
+    if args.save_baseline:
+        # Fixtures and stages not run keep their baseline
+        baseline = {}
+        if os.path.isfile(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        for name, stages in results.items():
+            baseline.setdefault(name, {}).update(stages)
+        baseline[CALIBRATION] = calibration
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent = 2, sort_keys = True)
+        logger.info(f'Baseline saved to  "{args.baseline}"')
+    elif os.path.isfile(args.baseline):
+        with open(args.baseline) as f:
+            regressions = get_regressions(results, json.load(f), calibration,
+                                          args.threshold, args.memory_threshold)
+        for regression in regressions:
+            logger.error(f'Regression # {regression}')
+        if len(regressions) > 0:
+            errcode = errcode or 3
+
+    return errcode
+
+
+if __name__ == '__main__':
+    sys.exit(main())
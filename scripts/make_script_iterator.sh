@@ -1,4 +1,8 @@
 # Generate command line iterator for a script
+#
+# Note: solar_prophet.py computes ranges in one process with
+#  '--last_day', '--month' or '--year' which is much faster
+#
 #  $1 script to be executed
 #  $2 year to start
 #  $3 month to start
@@ -11,6 +11,9 @@ setup(name='solar_prophet',
       author_email='r09491@gmail.com',
       license='MIT',
       long_description=long_description,
+      py_modules=[
+          'solar_prophet',
+      ],
       scripts=[
           './solar_prophet.py',
       ],
@@ -21,4 +24,9 @@ setup(name='solar_prophet',
           'pandas',
           'matplotlib',
       ],
+      extras_require={
+          'parquet': ['pyarrow'],
+          'yaml': ['pyyaml'],
+          'toml': ['tomli; python_version < "3.11"'],
+      },
       zip_safe=False)
@@ -9,128 +9,745 @@ __author__ = "sepp.heid@t-online.de"
 
 
 import argparse
+import asyncio
+import cProfile
+import csv
+import functools
+import json
 import os, sys
+import queue
+import tempfile
+import threading
+import time
 
 import numpy as np
 import pandas as pd
 
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-
-from datetime import datetime 
-from pysolar import solar, radiation
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta, timezone
+from itertools import repeat
 
 import warnings
-warnings.simplefilter("ignore")
 
 import logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(os.path.basename(sys.argv[0]))
+# The same name run as script or imported. The logging is configured by main only
+logger = logging.getLogger('solar_prophet' if __name__ == '__main__' else __name__)
+
+
+class Stage_Profiler(object):
+    """ Records the wall time, the CPU time and the net allocated blocks of
+    the stages. The net blocks are the change of 'sys.getallocatedblocks',
+    negative if a stage frees more than it allocates. Each record is written
+    as JSON line to the file or to stderr with '-' """
+
+    def __init__(self, full_save_name = None):
+        self.records = []
+        self.depth = 0
+        if full_save_name == '-':
+            self.file = sys.stderr
+        elif full_save_name is not None:
+            self.file = open(full_save_name, 'a', buffering = 1)
+        else:
+            self.file = None
+
+    @contextmanager
+    def stage(self, name):
+        self.depth += 1
+        blocks = sys.getallocatedblocks()
+        cpu = time.process_time()
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            record = {'stage': name,
+                      'wall': time.perf_counter() - begin,
+                      'cpu': time.process_time() - cpu,
+                      'net_blocks': sys.getallocatedblocks() - blocks,
+                      'depth': self.depth,
+                      'pid': os.getpid()}
+            self.depth -= 1
+            self.records.append(record)
+            if self.file is not None:
+                self.file.write(json.dumps(record) + '\n')
+
+    def get_summary(self):
+        """ The calls and totals of the stages recorded in this process """
+        summary = {}
+        for record in self.records:
+            totals = summary.setdefault(record['stage'], {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'net_blocks': 0})
+            totals['calls'] += 1
+            for key in ('wall', 'cpu', 'net_blocks'):
+                totals[key] += record[key]
+        return summary
+
+    def close(self):
+        if self.file is not None and self.file is not sys.stderr:
+            self.file.close()
+        self.file = None
+
+
+_profiler = None
+
+
+def set_profiler(profiler):
+    """ Sets the profiler recording the stages. None stops the recording.
+    Returns the previous profiler """
+    global _profiler
+    previous, _profiler = _profiler, profiler
+    return previous
+
+
+def profile_stage(name):
+    """ The context of a stage recorded if a profiler is set """
+    return nullcontext() if _profiler is None else _profiler.stage(name)
+
+
+def profiled(name):
+    """ Decorates a function as stage recorded if a profiler is set """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return function(*args, **kwargs)
+            with _profiler.stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
 
 
 def get_vector(azimuth, altitude):
+    """ Unit vector(s) for scalar or array azimuth/altitude in degrees """
     azi, alt = np.radians(azimuth), np.radians(altitude) 
-    dir = np.array([np.sin(azi), np.cos(azi), np.tan(alt)])
-    dir = -dir if altitude > 90 and altitude <= 270 else dir
-    norm = np.linalg.norm(dir)
+    dir = np.stack([np.sin(azi), np.cos(azi), np.tan(alt)], axis=-1)
+    flip = (np.asarray(altitude) > 90) & (np.asarray(altitude) <= 270)
+    dir = np.where(np.expand_dims(flip, -1), -dir, dir)
+    norm = np.linalg.norm(dir, axis=-1, keepdims=True)
     return dir / norm 
 
 
-class Panel_Power(object):
-
-    def __init__(self, lat, lon, name, direction, slope, area, efficiency, bifacial, albedo,system_barrier,
-                 inverter_limit, battery_split, battery_full, battery_first, day):
-        tzinfo = datetime.now().astimezone().tzinfo
-        start = datetime(day.year, day.month, day.day, tzinfo=tzinfo)
-        stamps = pd.date_range(start = start, periods = 24*60, freq = 'T', tz=tzinfo)
-        minutes = [stamp.to_pydatetime() for stamp in stamps]
-
-        alts = [solar.get_altitude(lat, lon, minute) for minute in minutes]
-        azis = [solar.get_azimuth(lat, lon, minute) for minute in minutes]
-        rads = [radiation.get_radiation_direct(minute, alt) for minute, alt in zip(minutes, alts)]
-        vecs = [get_vector(azi, alt) for azi, alt in zip(azis, alts)]
-
-        is_sun = np.array(alts) > 0
-        sunalts = np.array(alts)[is_sun]
-        sunazis = np.array(azis)[is_sun]
-        sunrads = np.array(rads)[is_sun]
-        sunvecs = np.array(vecs)[is_sun]
-
-        # Consider panel features 
-        best_w = sunrads*area*efficiency
-        best_w -= albedo*best_w
+""" The sun engines compute the sun track for a pandas date range in
+one go. 'numpy' is the built-in low precision solar position algorithm
+(Meeus, Astronomical Algorithms, chapter 25) with the topocentric
+parallax, refraction and direct radiation model of pysolar. 'pysolar'
+is the reference with scalar calls per minute. Between 1950 and 2050
+the engines agree within 0.02° in altitude, within 0.05° in azimuth
+below 85° altitude and within 1 W/m² (0.1%) in direct radiation. """
+
+SUN_ENGINES = ('numpy', 'pysolar')
+ENGINE_VERSION = 1 # Increment with any change of the sun track results
+
+STANDARD_PRESSURE = 101325.0 # Pa, as pysolar
+STANDARD_TEMPERATURE = 288.15 # K, as pysolar
+
+
+@profiled('geometry')
+def get_sun_track_pysolar(lat, lon, stamps):
+    """ The reference sun track with pysolar per minute """
+    from pysolar import solar, radiation
+
+    minutes = [stamp.to_pydatetime() for stamp in stamps]
+    alts = [solar.get_altitude(lat, lon, minute) for minute in minutes]
+    azis = [solar.get_azimuth(lat, lon, minute) for minute in minutes]
+    rads = [radiation.get_radiation_direct(minute, alt) for minute, alt in zip(minutes, alts)]
+    vecs = [get_vector(azi, alt) for azi, alt in zip(azis, alts)]
+
+    return np.array(alts), np.array(azis), np.array(rads), np.array(vecs)
+
+
+@profiled('geometry')
+def get_sun_position_numpy(lat, lon, seconds):
+    """ Altitudes and azimuths in degrees for the POSIX seconds """
+    jd = seconds / 86400.0 + 2440587.5
+    jde = jd + 69.184 / 86400.0 # TT - UT, close enough for decades
+    t = (jde - 2451545.0) / 36525.0
+
+    # Geometric mean longitude, mean anomaly and eccentricity
+    l0 = 280.46646 + 36000.76983*t + 0.0003032*t**2
+    m = np.radians(357.52911 + 35999.05029*t - 0.0001537*t**2)
+    e = 0.016708634 - 0.000042037*t - 0.0000001267*t**2
+
+    # Equation of center, true longitude and distance in AU
+    c = (1.914602 - 0.004817*t - 0.000014*t**2)*np.sin(m)
+    c += (0.019993 - 0.000101*t)*np.sin(2*m) + 0.000289*np.sin(3*m)
+    nu = m + np.radians(c)
+    distance = 1.000001018*(1 - e**2)/(1 + e*np.cos(nu))
+
+    # Nutation, aberration and obliquity
+    omega = np.radians(125.04452 - 1934.136261*t)
+    lm = np.radians(218.3165 + 481267.8813*t)
+    l0r = np.radians(l0)
+    dpsi = (-17.20*np.sin(omega) - 1.32*np.sin(2*l0r)
+            - 0.23*np.sin(2*lm) + 0.21*np.sin(2*omega)) / 3600
+    deps = (9.20*np.cos(omega) + 0.57*np.cos(2*l0r)
+            + 0.10*np.cos(2*lm) - 0.09*np.cos(2*omega)) / 3600
+    eps = 23.0 + 26.0/60 + (21.448 - 46.8150*t - 0.00059*t**2 + 0.001813*t**3)/3600
+    eps = np.radians(eps + deps)
+    lam = np.radians(l0 + c + dpsi - 20.4898/3600/distance)
+
+    # Geocentric right ascension and declination
+    alpha = np.arctan2(np.cos(eps)*np.sin(lam), np.cos(lam))
+    delta = np.arcsin(np.sin(eps)*np.sin(lam))
+
+    # Apparent sidereal time and local hour angle
+    jc = (jd - 2451545.0) / 36525.0
+    theta = 280.46061837 + 360.98564736629*(jd - 2451545.0)
+    theta += 0.000387933*jc**2 - jc**3/38710000 + dpsi*np.cos(eps)
+    h = np.radians((theta + lon) % 360) - alpha
+
+    # Topocentric parallax for a position on sea level
+    phi = np.radians(lat)
+    u = np.arctan(0.99664719*np.tan(phi))
+    rho_cos, rho_sin = np.cos(u), 0.99664719*np.sin(u)
+    xi = np.radians(8.794/3600/distance)
+    parallax = rho_cos*np.sin(xi)
+    denominator = np.cos(delta) - parallax*np.cos(h)
+    dalpha = np.arctan2(-parallax*np.sin(h), denominator)
+    tdelta = np.arctan2((np.sin(delta) - rho_sin*np.sin(xi))*np.cos(dalpha), denominator)
+    th = h - dalpha
+    cos_th = np.cos(th)
+
+    # Elevation with refraction and azimuth relative to north
+    elevation = np.degrees(np.arcsin(np.sin(phi)*np.sin(tdelta)
+                                     + np.cos(phi)*np.cos(tdelta)*cos_th))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        refraction = STANDARD_PRESSURE*2.830*1.02 / (1010.0*STANDARD_TEMPERATURE*60.0*
+            np.tan(np.radians(elevation + 10.3/(elevation + 5.11))))
+    refraction = np.where(elevation >= -(0.26667 + 0.5667), refraction, 0.0)
+    altitude = elevation + refraction
+
+    azimuth = np.degrees(np.arctan2(np.sin(th), cos_th*np.sin(phi)
+                                    - np.tan(tdelta)*np.cos(phi)))
+    azimuth = (180.0 + azimuth) % 360
+
+    return altitude, azimuth
+
+
+@profiled('radiation')
+def get_radiation_direct_numpy(yday, altitude):
+    """ The direct radiation in W/m² as pysolar for the UTC day of year """
+    flux = 1160 + 75*np.sin(2*np.pi/365*(yday - 275))
+    optical_depth = 0.174 + 0.035*np.sin(2*np.pi/365*(yday - 100))
+    is_daytime = altitude > 0
+    with np.errstate(divide='ignore'):
+        air_mass_ratio = 1/np.sin(np.radians(np.where(is_daytime, altitude, 90.0)))
+    return np.where(is_daytime, flux*np.exp(-optical_depth*air_mass_ratio), 0.0)
+
+
+def get_sun_track_numpy(lat, lon, stamps):
+    """ The sun track with array operations for all stamps """
+    seconds = stamps.asi8 / 1e9
+    utc_days = (stamps.asi8 // (86400*10**9)).astype('datetime64[D]')
+    ydays = (utc_days - utc_days.astype('datetime64[Y]')).astype(int) + 1
+    alts, azis = get_sun_position_numpy(lat, lon, seconds)
+    rads = get_radiation_direct_numpy(ydays, alts)
+    vecs = get_vector(azis, alts)
+
+    return alts, azis, rads, vecs
+
+
+def get_sun_track(lat, lon, stamps, engine = 'numpy'):
+    """ Altitudes, azimuths, direct radiations and vectors to the sun """
+    if engine == 'pysolar':
+        return get_sun_track_pysolar(lat, lon, stamps)
+    return get_sun_track_numpy(lat, lon, stamps)
+
+
+class Sun_Cache(object):
+    """ Directory of memory mapped sun tracks with an LRU eviction by size.
+    A sun track is stored as an array with a row for each minute the sun
+    is up: the minute of the day, altitude, azimuth, radiation and vector.
+    The directory is created if missing """
+
+    def __init__(self, directory, max_size = 64*2**20):
+        os.makedirs(directory, exist_ok = True)
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def get_path(self, lat, lon, start, engine, resolution = 1):
+        name = f'{engine}{ENGINE_VERSION}'
+        if resolution > 1:
+            name += f'r{resolution}'
+        name += f'_{lat:.5f}_{lon:.5f}'
+        name += start.strftime('_%Y%m%d%z') + '.npy'
+        return os.path.join(self.directory, name)
+
+    def load(self, lat, lon, start, engine, resolution = 1):
+        path = self.get_path(lat, lon, start, engine, resolution)
+        try:
+            try:
+                track = np.load(path, mmap_mode = 'r')
+            except ValueError:
+                # Empty tracks in polar nights cannot be mapped
+                track = np.load(path)
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return track
+
+    def save(self, lat, lon, start, engine, track, resolution = 1):
+        path = self.get_path(lat, lon, start, engine, resolution)
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(temp_path, 'wb') as f:
+                np.save(f, track)
+            os.replace(temp_path, path)
+        except OSError as e:
+            # The forecast does not depend on the cache
+            logger.warning(f'The sun track cannot be cached "{path}": {e}')
+            return
+        self.evict()
+
+    def evict(self):
+        """ Removes the least recently used tracks beyond the maximum size """
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith('.npy'):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        size = sum(entry[1] for entry in entries)
+        for mtime, entry_size, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            size -= entry_size
+
+    def clear(self):
+        """ Invalidates all tracks """
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith('.npy'):
+                    os.remove(entry.path)
+
+
+class Memory_Sun_Cache(object):
+    """ Sun tracks in memory with an LRU eviction by count. Same interface
+    as Sun_Cache and safe for threads """
+
+    def __init__(self, max_tracks = 4096):
+        self.max_tracks = max_tracks
+        self.tracks = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_key(self, lat, lon, start, engine, resolution = 1):
+        return (engine, ENGINE_VERSION, resolution, round(lat, 5), round(lon, 5), start.isoformat())
+
+    def load(self, lat, lon, start, engine, resolution = 1):
+        key = self.get_key(lat, lon, start, engine, resolution)
+        with self.lock:
+            track = self.tracks.get(key)
+            if track is None:
+                self.misses += 1
+                return None
+            self.tracks.move_to_end(key)
+            self.hits += 1
+            return track
+
+    def save(self, lat, lon, start, engine, track, resolution = 1):
+        key = self.get_key(lat, lon, start, engine, resolution)
+        with self.lock:
+            self.tracks[key] = track
+            while len(self.tracks) > self.max_tracks:
+                self.tracks.popitem(last = False)
+
+    def clear(self):
+        with self.lock:
+            self.tracks.clear()
+
+
+""" The daylight window is computed analytically from the sunrise hour
+angle with the low precision solar coordinates of the Astronomical
+Almanac for SUN_WINDOW_ALTITUDE, widened by SUN_WINDOW_MARGIN. Only the
+minutes of the window are evaluated. Close to polar days and nights the
+whole day is evaluated, as well as if the sun is up at an edge. """
+
+SUN_WINDOW_ALTITUDE = -2.0 # deg, below refraction and parallax
+SUN_WINDOW_MARGIN = 15 # min
+SUN_WINDOW_POLAR = 0.9 # cosine of the sunrise hour angle
+
+""" With a resolution above one minute the sun track is evaluated every
+resolution minutes and linearly interpolated in between where the sun is
+above SMOOTH_ALTITUDE at both ends. Near sunrise and sunset every minute
+is evaluated. Over a year from the equator to the polar circle the daily
+energies deviate less than 0.05% at 5 minutes, 0.1% at 10 minutes and
+0.25% at 15 minutes from the exact track. A minute switched by the
+system barrier may add its power. It pays with the slow pysolar engine,
+the numpy engine is bound by the costs per call. """
+
+MAX_RESOLUTION = 15 # min
+SMOOTH_ALTITUDE = 10.0 # deg
+
+
+def get_sun_windows(lat, lon, stamps):
+    """ The first and the end indexes of the minute stamps with the sun
+    up. The windows of the solar noons of the day and its neighbours are
+    evaluated since the sun may be up at both ends of a local day """
+    start = stamps[0].value / 1e9
+    middle = start + 30*len(stamps)
+
+    # Days since J2000, mean longitude, mean anomaly and ecliptic longitude
+    n = (middle - 946728000) / 86400 + np.array([-1, 0, 1])
+    l = 280.460 + 0.9856474*n
+    g = np.radians(357.528 + 0.9856003*n)
+    lam = np.radians(l + 1.915*np.sin(g) + 0.020*np.sin(2*g))
+    eps = np.radians(23.439 - 0.0000004*n)
+    alpha = np.degrees(np.arctan2(np.cos(eps)*np.sin(lam), np.cos(lam)))
+    delta = np.arcsin(np.sin(eps)*np.sin(lam))
+
+    # Solar noons before, next to and after the middle
+    eot = (l - alpha + 180) % 360 - 180
+    noon = (720 - 4*lon - 4*eot)*60
+    noon += (np.round((middle - noon[1]) / 86400) + np.array([-1, 0, 1]))*86400
+
+    # Sunrise hour angles
+    phi = np.radians(lat)
+    cos_h0 = ((np.sin(np.radians(SUN_WINDOW_ALTITUDE)) - np.sin(phi)*np.sin(delta))
+              / (np.cos(phi)*np.cos(delta)))
+    if np.any(np.abs(cos_h0) > SUN_WINDOW_POLAR):
+        return [(0, len(stamps))]
+
+    half = 4*np.degrees(np.arccos(cos_h0)) + SUN_WINDOW_MARGIN
+    firsts = np.clip(np.floor((noon - start) / 60 - half), 0, len(stamps)).astype(int)
+    ends = np.clip(np.ceil((noon - start) / 60 + half) + 1, 0, len(stamps)).astype(int)
+
+    windows = []
+    for first, end in zip(firsts, ends):
+        if end <= first:
+            continue
+        if len(windows) > 0 and first <= windows[-1][1]:
+            windows[-1] = (windows[-1][0], max(windows[-1][1], end))
+        else:
+            windows.append((first, end))
+    return windows
+
+
+def get_sun_track_interpolated(lat, lon, stamps, engine = 'numpy', resolution = 1):
+    """ The sun track evaluated every resolution minutes and interpolated
+    where it is smooth. The vectors are interpolated since the azimuth
+    turns fast close to the zenith """
+    knots = np.unique(np.append(np.arange(0, len(stamps), resolution), len(stamps) - 1))
+    if resolution == 1 or len(knots) < 3:
+        return get_sun_track(lat, lon, stamps, engine)
+
+    knot_alts, knot_azis, knot_rads, knot_vecs = get_sun_track(lat, lon, stamps[knots], engine)
+    minutes = np.arange(len(stamps))
+    rads = np.interp(minutes, knots, knot_rads)
+    vecs = np.column_stack([np.interp(minutes, knots, knot_vecs[:, i]) for i in range(3)])
+    vecs /= np.linalg.norm(vecs, axis = 1, keepdims = True)
+    alts = np.degrees(np.arcsin(vecs[:, 2]))
+    azis = np.degrees(np.arctan2(vecs[:, 0], vecs[:, 1])) % 360
+
+    # The knots and the rough minutes near sunrise and sunset are exact
+    is_smooth = knot_alts >= SMOOTH_ALTITUDE
+    intervals = np.minimum(np.searchsorted(knots, minutes, side = 'right') - 1, len(knots) - 2)
+    is_rough = ~(is_smooth[intervals] & is_smooth[intervals + 1])
+    is_rough[knots] = False
+    alts[knots], azis[knots], rads[knots], vecs[knots] = knot_alts, knot_azis, knot_rads, knot_vecs
+    if is_rough.any():
+        alts[is_rough], azis[is_rough], rads[is_rough], vecs[is_rough] = \
+            get_sun_track(lat, lon, stamps[is_rough], engine)
+
+    return alts, azis, rads, vecs
+
+
+@profiled('sun_track')
+def get_sun_minutes(lat, lon, stamps, engine = 'numpy', cache = None, resolution = 1):
+    """ The sun track for the minutes the sun is up. Loaded from the
+    cache if available """
+    track = None if cache is None else cache.load(lat, lon, stamps[0], engine, resolution)
+    if track is None:
+        windows = get_sun_windows(lat, lon, stamps)
+        tracks = [get_sun_track_interpolated(lat, lon, stamps[first:end], engine, resolution)
+                  for first, end in windows]
+        if any((first > 0 and alts[0] > 0) or (end < len(stamps) and alts[-1] > 0)
+               for (first, end), (alts, _, _, _) in zip(windows, tracks)):
+            # The sun is up at an edge of a window
+            windows = [(0, len(stamps))]
+            tracks = [get_sun_track_interpolated(lat, lon, stamps, engine, resolution)]
+
+        track = np.zeros((0, 7))
+        for (first, end), (alts, azis, rads, vecs) in zip(windows, tracks):
+            is_sun = alts > 0
+            track = np.concatenate([track, np.column_stack([first + np.flatnonzero(is_sun),
+                                                            alts[is_sun], azis[is_sun],
+                                                            rads[is_sun], vecs[is_sun]])])
+        if cache is not None:
+            cache.save(lat, lon, stamps[0], engine, track, resolution)
+    return track
+
+
+@profiled('array_power')
+def get_array_power(sunrads, sunvecs, direction, slope, area, efficiency, bifacial, albedo):
+    """ The best and the actual power of panel arrays for the minutes
+    with sun. The panel features may be given for several arrays. Each
+    array is a column of the returned minutes x arrays matrices """
+    directions, slopes, areas, efficiencies, bifacials, albedos = \
+        np.broadcast_arrays(*(np.atleast_1d(np.asarray(v, dtype = float)) for v in
+                              (direction, slope, area, efficiency, bifacial, albedo)))
+
+    # Consider panel features 
+    array_best_w = sunrads[:, None]*areas*efficiencies
+    array_best_w -= albedos*array_best_w
         
-        # Cosine between actual vector to sun and norm vector of panel
-        suncos = np.dot(sunvecs, get_vector(direction, slope))
+    # Cosine between actual vector to sun and norm vectors of panels
+    suncos = np.dot(sunvecs, get_vector(directions, slopes).T)
 
-        # Consider attitude of panel and direct radiation from the front
-        direct_w = best_w*suncos
-        direct_w[suncos<0] = 0
+    # Consider attitude of panel and direct radiation from the front
+    direct_w = array_best_w*suncos
+    direct_w[suncos<0] = 0
 
-        tot_w = direct_w
+    array_w = direct_w
         
-        # Consider attitude of panel and bifacial radiation from the rear
-        bifacial_w = best_w*suncos
-        bifacial_w[suncos>=0] = 0
-        bifacial_w *= -bifacial
+    # Consider attitude of panel and bifacial radiation from the rear
+    bifacial_w = array_best_w*suncos
+    bifacial_w[suncos>=0] = 0
+    bifacial_w *= -bifacials
         
-        tot_w += bifacial_w
+    array_w += bifacial_w
 
-        # Consider the albedo effect
-        tot_w += albedo*tot_w
+    # Consider the albedo effect
+    array_w += albedos*array_w
 
-        # Consider start barrier        
-        tot_w[:np.where(tot_w >= system_barrier)[0][0]] = 0
-
-        if battery_first:
-            """ The power is delivered to the battery first """
-            bat_w = tot_w.copy()
-            if battery_split is not None:
-                bat_w[bat_w > battery_split] = battery_split
-            bat_wh = bat_w.cumsum()/60
-            if battery_full is not None:
-                bat_wh[bat_wh >= battery_full] = battery_full
-                bat_w[bat_wh >= battery_full] = 0
-
-            """ The rest is for the house """
-            
-            house_w = tot_w.copy() - bat_w
-            if inverter_limit is not None:
-                house_w[house_w > inverter_limit] = inverter_limit
-            house_wh = house_w.cumsum()/60
-            if battery_split is not None:
-                bat_w[bat_w > battery_split] = battery_split
+    return array_best_w, array_w
 
-        else:
-            """ The power is delivered to the house first """
 
-            house_w = tot_w.copy()
-            if battery_split is not None:
-                house_w[house_w > battery_split] = battery_split
-            if inverter_limit is not None:
-                house_w[house_w > inverter_limit] = inverter_limit
-            house_wh = house_w.cumsum()/60
+def apply_barrier(tot_w, system_barrier):
+    """ Zeroes the power before the system is working the first time.
+    The minutes are the last axis """
+    tot_w[~np.maximum.accumulate(tot_w >= system_barrier, axis = -1)] = 0
 
-            """ The rest is for the battery """
 
-            bat_w = np.full_like(tot_w, 0.0) \
-                if battery_split is None \
-                else tot_w.copy() - house_w
-            bat_wh = bat_w.cumsum()/60
-            if battery_full is not None:
-                bat_wh[bat_wh >= battery_full] = battery_full
-                bat_w[bat_wh >= battery_full] = 0
+@profiled('dispatch')
+def get_dispatch(tot_w, inverter_limit, battery_split, battery_full, battery_first):
+    """ The power and energy for the house, the battery and the lost.
+    The minutes are the last axis. The limits may be columns of rows """
+    if battery_first:
+        """ The power is delivered to the battery first """
+        bat_w = tot_w.copy()
+        if battery_split is not None:
+            np.minimum(bat_w, battery_split, out = bat_w)
+        bat_wh = bat_w.cumsum(axis = -1)/60
+        if battery_full is not None:
+            np.minimum(bat_wh, battery_full, out = bat_wh)
+            bat_w[bat_wh >= battery_full] = 0
 
-        lost_w = tot_w.copy() - house_w - bat_w
-        lost_wh = lost_w.cumsum()/60
+        """ The rest is for the house """
+            
+        house_w = tot_w.copy() - bat_w
+        if inverter_limit is not None:
+            np.minimum(house_w, inverter_limit, out = house_w)
+        house_wh = house_w.cumsum(axis = -1)/60
+        if battery_split is not None:
+            np.minimum(bat_w, battery_split, out = bat_w)
+
+    else:
+        """ The power is delivered to the house first """
+
+        house_w = tot_w.copy()
+        if battery_split is not None:
+            np.minimum(house_w, battery_split, out = house_w)
+        if inverter_limit is not None:
+            np.minimum(house_w, inverter_limit, out = house_w)
+        house_wh = house_w.cumsum(axis = -1)/60
+
+        """ The rest is for the battery """
+
+        bat_w = np.full_like(tot_w, 0.0) \
+            if battery_split is None \
+            else tot_w.copy() - house_w
+        bat_wh = bat_w.cumsum(axis = -1)/60
+        if battery_full is not None:
+            np.minimum(bat_wh, battery_full, out = bat_wh)
+            bat_w[bat_wh >= battery_full] = 0
+
+    lost_w = tot_w.copy() - house_w - bat_w
+    lost_wh = lost_w.cumsum(axis = -1)/60
+
+    return house_w, bat_w, lost_w, house_wh, bat_wh, lost_wh
+
+
+HORIZON_STEP = 0.1 # deg of azimuth per entry of the lookup table
+
+
+def load_horizon(full_load_name):
+    """ The azimuth and altitude pairs of a horizon from the columns
+    azimuth and altitude of a CSV file or from a JSON list of pairs """
+    if full_load_name.lstrip().startswith('['):
+        return json.loads(full_load_name)
+    df = pd.read_csv(full_load_name)
+    return df[['azimuth', 'altitude']].astype(float).to_numpy().tolist()
+
+
+def get_profile_key(profile):
+    """ The azimuth and altitude pairs as hashable tuple, None without """
+    return None if profile is None else tuple((float(azi), float(alt)) for azi, alt in profile)
+
+
+@functools.lru_cache(maxsize = 16)
+def compile_horizon(horizon, shadings):
+    """ The lookup table of the lowest altitudes with sun for the
+    azimuths in steps of HORIZON_STEP. Each array is a column of the
+    higher of the site horizon and its shading. The profiles are
+    interpolated around the circle """
+    azimuths = np.arange(0, 360, HORIZON_STEP)
+    table = np.full((len(azimuths), len(shadings)), -90.0)
+    for i, profile in enumerate(shadings):
+        for pairs in (horizon, profile):
+            if pairs is not None and len(pairs) > 0:
+                azis, alts = np.array(pairs).T
+                np.maximum(table[:, i], np.interp(azimuths, azis, alts, period = 360),
+                           out = table[:, i])
+    return table
+
+
+def get_shaded(table, azimuths, altitudes):
+    """ The minutes x arrays mask of the sun behind the horizon """
+    index = np.rint(azimuths/HORIZON_STEP).astype(np.intp) % len(table)
+    return altitudes[:, None] < table[index]
+
+
+ENSEMBLE_PERCENTILES = (10, 50, 90)
+ENSEMBLE_COLUMNS = ('tot_w', 'tot_wh', 'house_wh', 'bat_wh', 'lost_wh')
+MAX_ALBEDO = 0.3 # as the argument checks
+
+
+def get_scenarios(count, efficiency, albedo, cloud, seed = 0):
+    """ The scenarios of an ensemble. The factors of the efficiency have
+    the relative deviation efficiency, the albedos are shifted with the
+    deviation albedo and the weather factors are converted from a cloud
+    cover uniform up to cloud. The same seed gives the same scenarios """
+    rng = np.random.default_rng(seed)
+    return {'efficiency': np.maximum(rng.normal(1.0, efficiency, count), 0.0),
+            'albedo': rng.normal(0.0, albedo, count),
+            'weather': 1 - 0.75*rng.uniform(0.0, cloud, count)**3.4}
+
+
+@profiled('ensemble')
+def get_ensemble(array_w, albedo, scenarios, system_barrier, inverter_limit,
+                 battery_split, battery_full, battery_first):
+    """ The percentile bands of the minutes and the percentiles of the
+    day totals of the scenarios. The power of the arrays is scaled for
+    all scenarios x minutes at once and dispatched as a whole """
+    albedos = np.broadcast_to(np.asarray(albedo, dtype = float), array_w.shape[1:])
+    shifted = np.clip(albedos + scenarios['albedo'][:, None], 0.0, MAX_ALBEDO)
+    weights = (1 - shifted**2)/(1 - albedos**2)
+    weights *= (scenarios['efficiency']*scenarios['weather'])[:, None]
+
+    tot_w = weights @ array_w.T
+    apply_barrier(tot_w, system_barrier)
+    house_w, bat_w, lost_w, house_wh, bat_wh, lost_wh = \
+        get_dispatch(tot_w, inverter_limit, battery_split, battery_full, battery_first)
+    del house_w, bat_w, lost_w
+    tot_wh = tot_w.cumsum(axis = -1)/60
+
+    columns, totals = {}, {}
+    for column, values in zip(ENSEMBLE_COLUMNS, (tot_w, tot_wh, house_wh, bat_wh, lost_wh)):
+        bands = np.percentile(values, ENSEMBLE_PERCENTILES, axis = 0)
+        columns.update({f'{column}_p{p}': band for p, band in zip(ENSEMBLE_PERCENTILES, bands)})
+        if column != 'tot_w':
+            last = values[:, -1] if values.shape[-1] > 0 else np.zeros(len(values))
+            totals[column] = np.percentile(last, ENSEMBLE_PERCENTILES)
+    return columns, totals
+
+
+def get_day_stamps(day, tzinfo = None):
+    """ The minutes of the day in the local timezone """
+    tzinfo = tzinfo or datetime.now().astimezone().tzinfo
+    start = datetime(day.year, day.month, day.day, tzinfo=tzinfo)
+    return pd.date_range(start = start, periods = 24*60, freq = 'min', tz=tzinfo)
 
-        data = {'azimuth':sunazis, 'altitude':sunalts,'sunrads':sunrads,
-                'best_w':best_w, 'tot_w':tot_w, 'house_w':house_w, 'bat_w':bat_w,
-                'lost_w':lost_w, 'house_wh':house_wh, 'bat_wh':bat_wh,'lost_wh':lost_wh}
-        self.df = pd.DataFrame(data = data, index = stamps[is_sun])
 
+class Panel_Power(object):
+    """ The forecast of a day. The columns of the sun minutes are kept
+    in the structured array data and the minutes of the day in minutes.
+    The stamps and the DataFrame df are only built on demand. The weather
+    factors of the minutes of the day attenuate the radiation. The
+    compiled horizon zeroes the arrays with the sun behind it. The
+    percentiles of the scenarios of an ensemble are kept as bands in
+    data and as day totals in ensemble """
+
+    __slots__ = ('day', 'minutes', 'data', 'cached', 'array_names', 'efficiency',
+                 'inverter_limit', 'battery_split', 'battery_full', 'battery_first',
+                 'tzinfo', 'name', 'ensemble', '_df')
+
+    @profiled('panel_power')
+    def __init__(self, lat, lon, name, direction, slope, area, efficiency, bifacial, albedo,system_barrier,
+                 inverter_limit, battery_split, battery_full, battery_first, day, engine = 'numpy', cache = None,
+                 array_names = None, resolution = 1, weather = None, horizon = None,
+                 ensemble = None):
+        stamps = get_day_stamps(day)
+        tzinfo = stamps.tz
+
+        hits = 0 if cache is None else cache.hits
+        track = get_sun_minutes(lat, lon, stamps, engine, cache, resolution)
+        self.cached = cache is not None and cache.hits > hits
+
+        sunalts = np.array(track[:,1])
+        sunazis = np.array(track[:,2])
+        sunrads = np.array(track[:,3])
+        sunvecs = np.array(track[:,4:7])
+        if weather is not None:
+            factors = weather[track[:,0].astype(int)]
+            factors[np.isnan(factors)] = 1.0
+            sunrads *= factors
+
+        array_best_w, array_w = get_array_power(sunrads, sunvecs, direction, slope,
+                                                area, efficiency, bifacial, albedo)
+
+        # Consider the horizon and the shading of the arrays
+        if horizon is not None:
+            shaded = get_shaded(horizon, sunazis, sunalts)
+            array_best_w[shaded] = 0
+            array_w[shaded] = 0
+
+        # One inverter and battery serves all arrays
+        best_w = array_best_w.sum(axis = 1)
+        tot_w = array_w.sum(axis = 1)
+
+        # Consider start barrier        
+        apply_barrier(tot_w, system_barrier)
+
+        house_w, bat_w, lost_w, house_wh, bat_wh, lost_wh = \
+            get_dispatch(tot_w, inverter_limit, battery_split, battery_full, battery_first)
+
+        columns = {'azimuth':sunazis, 'altitude':sunalts,'sunrads':sunrads,
+                   'best_w':best_w, 'tot_w':tot_w, 'house_w':house_w, 'bat_w':bat_w,
+                   'lost_w':lost_w, 'house_wh':house_wh, 'bat_wh':bat_wh,'lost_wh':lost_wh}
+        if array_w.shape[1] > 1:
+            columns.update({f'tot_w_{i+1}':array_w[:, i] for i in range(array_w.shape[1])})
+        if weather is not None:
+            columns['weather'] = factors
+        if horizon is not None:
+            columns['shaded'] = shaded.mean(axis = 1)
+        self.ensemble = None
+        if ensemble is not None:
+            ensemble_columns, self.ensemble = get_ensemble(array_w, albedo, ensemble, system_barrier,
+                                                           inverter_limit, battery_split,
+                                                           battery_full, battery_first)
+            columns.update(ensemble_columns)
+        self.data = np.empty(len(track), dtype = [(column, np.float64) for column in columns])
+        for column, values in columns.items():
+            self.data[column] = values
+        self.minutes = track[:,0].astype(np.int32)
+        self.day = day
+        self._df = None
+
+        self.array_names = array_names if array_w.shape[1] > 1 else None
         self.efficiency = efficiency
         self.inverter_limit = inverter_limit
 
@@ -142,28 +759,40 @@ class Panel_Power(object):
         self.tzinfo = tzinfo
         self.name = name
 
+
+    @property
+    def stamps(self):
+        """ The stamps of the sun minutes """
+        return get_day_stamps(self.day, self.tzinfo)[self.minutes]
+
+
+    @property
+    def df(self):
+        """ The DataFrame of the sun minutes, built on the first access """
+        if self._df is None:
+            with profile_stage('dataframe'):
+                self._df = pd.DataFrame(data = self.data, index = self.stamps)
+        return self._df
+
         
+    @profiled('summarize')
     def summarize(self):
-        dates = self.df.index
-        azis = self.df.azimuth
-        alts = self.df.altitude
-        rads = self.df.sunrads
-        best_w = self.df.best_w
-        tot_w = self.df.tot_w
+        dates = self.stamps
+        azis = self.data['azimuth']
+        alts = self.data['altitude']
+        rads = self.data['sunrads']
+        tot_w = self.data['tot_w']
         name = self.name
 
-        maxradsdate = rads.argmax()
-        maxradsazi = azis[maxradsdate]
-        maxradsalt = alts[maxradsdate]
-
-        if type(maxradsdate) == np.int64:
-            # python >= 3.11
-            maxradsdate = dates[maxradsdate]
-              
         if len(dates[tot_w>0]) == 0:
             logger.info("No Harvesting in the provided configuration!")
             return 1
 
+        maxradsdate = rads.argmax()
+        maxradsazi = azis[maxradsdate]
+        maxradsalt = alts[maxradsdate]
+        maxradsdate = dates[maxradsdate]
+
         text = f'Best Radiation Attitude #'
         text += f' "{maxradsazi:.0f}/{maxradsalt:.0f}"'
         text += f' @ "{maxradsdate.strftime("%H:%M %Z")}"'
@@ -187,151 +816,1575 @@ class Panel_Power(object):
         text += f' Total:"{np.sum(tot_w/60):.0f}Wh",'
         text += f' "{np.sum(tot_w/60/12.5):.0f}Ah"'
         logger.info(text)
+
+        if self.array_names is not None:
+            for i, array_name in enumerate(self.array_names):
+                array_w = self.data[f'tot_w_{i+1}']
+                text = f'Array # "{array_name}",'
+                text += f' Mean:"{np.mean(array_w):.0f}W",'
+                text += f' Max:"{np.max(array_w):.0f}W",'
+                text += f' Total:"{np.sum(array_w/60):.0f}Wh"'
+                logger.info(text)
+
+        if self.ensemble is not None:
+            for column, label in zip(ENSEMBLE_COLUMNS[1:], ('Total', 'House', 'Bat', 'Lost')):
+                text = f'Ensemble # "{label}",'
+                text += ','.join(f' P{p}:"{total:.0f}Wh"'
+                                 for p, total in zip(ENSEMBLE_PERCENTILES, self.ensemble[column]))
+                logger.info(text)
         
         return 0
 
     
+    def get_summary(self):
+        """ The figures of summarize as dictionary. The rises and sets
+        are None and the energies zero without sun """
+        dates = self.stamps
+        tot_w = self.data['tot_w']
+        harvest_dates = dates[tot_w > 0]
+        has_sun, has_harvest = len(self.minutes) > 0, len(harvest_dates) > 0
+        summary = {'day': self.day.strftime('%Y-%m-%d'),
+                   'sun_rise': dates[0].isoformat() if has_sun else None,
+                   'sun_set': dates[-1].isoformat() if has_sun else None,
+                   'sun_wh_m2': float(self.data['sunrads'].sum()/60),
+                   'harvest_rise': harvest_dates[0].isoformat() if has_harvest else None,
+                   'harvest_set': harvest_dates[-1].isoformat() if has_harvest else None,
+                   'mean_w': float(tot_w.mean()) if has_sun else 0.0,
+                   'max_w': float(tot_w.max()) if has_sun else 0.0,
+                   'tot_wh': float(tot_w.sum()/60),
+                   'house_wh': float(self.data['house_wh'][-1]) if has_sun else 0.0,
+                   'bat_wh': float(self.data['bat_wh'][-1]) if has_sun else 0.0,
+                   'lost_wh': float(self.data['lost_wh'][-1]) if has_sun else 0.0}
+        if self.ensemble is not None:
+            summary['ensemble'] = {f'{column}_p{p}': float(total)
+                                   for column, totals in self.ensemble.items()
+                                   for p, total in zip(ENSEMBLE_PERCENTILES, totals)}
+        return summary
+
+
+    def get_totals(self):
+        """ The figures of summarize as numbers. The rises and sets are
+        the minutes of the day, None without """
+        tot_w = self.data['tot_w']
+        harvest_minutes = self.minutes[tot_w > 0]
+        has_sun, has_harvest = len(self.minutes) > 0, len(harvest_minutes) > 0
+        return {'day': self.day,
+                'sun_minutes': len(self.minutes),
+                'harvest_minutes': len(harvest_minutes),
+                'sun_rise': int(self.minutes[0]) if has_sun else None,
+                'sun_set': int(self.minutes[-1]) if has_sun else None,
+                'harvest_rise': int(harvest_minutes[0]) if has_harvest else None,
+                'harvest_set': int(harvest_minutes[-1]) if has_harvest else None,
+                'sun_wh_m2': float(self.data['sunrads'].sum()/60),
+                'max_w': float(tot_w.max()) if has_sun else 0.0,
+                'tot_wh': float(tot_w.sum()/60),
+                'house_wh': float(self.data['house_wh'][-1]) if has_sun else 0.0,
+                'bat_wh': float(self.data['bat_wh'][-1]) if has_sun else 0.0,
+                'lost_wh': float(self.data['lost_wh'][-1]) if has_sun else 0.0}
+
+    
+    @profiled('save_plot')
     def save_plot(self, lat, lon, direction, slope, area, full_save_name):
-        dformatter = mdates.DateFormatter('%H:%M')
-        dformatter.set_tzinfo(self.tzinfo)
-
-        dates = self.df.index
-        azis = self.df.azimuth
-        alts = self.df.altitude
-        rads = self.df.sunrads
-        best_w = self.df.best_w
-        tot_w = self.df.tot_w
-        house_w = self.df.house_w
-        bat_w = self.df.bat_w
-        lost_w = self.df.lost_w
-        house_wh = self.df.house_wh
-        bat_wh = self.df.bat_wh
-        lost_wh = self.df.lost_wh
-
-        best_mean = best_w.mean()
-        best_max = best_w.max()
-        best_sum = best_w.sum()/60
-        best_wh = best_w.cumsum()/60
+        renderer = Plot_Renderer(lat, lon, self.name, direction, slope, area,
+                                 self.array_names, self.tzinfo)
+        renderer.render(self)
+        renderer.save(full_save_name)
+        renderer.close()
 
-        tot_mean = tot_w.mean()
-        tot_max = tot_w.max()
-        tot_sum = tot_w.sum()/60
-        tot_wh = tot_w.cumsum()/60
 
-        pefficiency = self.efficiency
-        ilimit = self.inverter_limit
-        bsplit = self.battery_split
-        bfull =  self.battery_full
-        bfirst =  self.battery_first
+    @profiled('save_csv')
+    def save_csv(self, full_save_name):
+        self.df.to_csv(full_save_name)
+
+
+PLOT_FORMATS = ('png', 'pdf')
+
+
+def import_pyplot():
+    """ Imports pyplot on the first plot only, with the Agg backend unless
+    the caller has chosen one. The forecasts alone do not need matplotlib """
+    if 'matplotlib.pyplot' not in sys.modules:
+        import matplotlib
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
+class Plot_Renderer(object):
+    """ The figure of the day plots is built once. Each day only swaps the
+    data of the lines, fills and titles. The layout is computed for the
+    first day and kept for all others """
+
+    def __init__(self, lat, lon, name, direction, slope, area, array_names, tzinfo):
+        self.lat = lat
+        self.lon = lon
+        self.name = name
+        self.direction = direction
+        self.slope = slope
+        self.area = area
+        self.laid_out = False
+
+        plt = import_pyplot()
+        import matplotlib.dates as mdates
+
+        dformatter = mdates.DateFormatter('%H:%M')
+        dformatter.set_tzinfo(tzinfo)
 
         """ Prepare plots """
 
-        today = dates[0].strftime("%Y-%m-%d")
-        text = f'{self.name} Forecast {today}'
         fig, axes = plt.subplots(nrows=5, figsize=(9,12))
-        fig.text(0.5, 0.0, text, ha='center', fontsize='x-large')
+        self.fig = fig
+        self.axes = axes
+        self.text = fig.text(0.5, 0.0, '', ha='center', fontsize='x-large')
 
-        axes[0].plot(dates, azis, color='red')
-        axes[0].grid(which='major', linestyle='-', linewidth=2, axis='both')
-        axes[0].grid(which='minor', linestyle='--', linewidth=1, axis='x')
-        axes[0].minorticks_on()
+        self.azi_line, = axes[0].plot([], [], color='red')
         axes[0].set_title(f'Sun Azimuth @ {lat:.2f}/{lon:.2f}')
         axes[0].set_ylabel('Azimuth [deg]')
-        axes[0].xaxis.set_major_formatter(dformatter)
 
-        axes[1].plot(dates, alts, color='red')
-        axes[1].grid(which='major', linestyle='-', linewidth=2, axis='both')
-        axes[1].grid(which='minor', linestyle='--', linewidth=1, axis='x')
-        axes[1].minorticks_on()
+        self.alt_line, = axes[1].plot([], [], color='red')
         axes[1].set_title(f'Sun Altitude @ {lat:.2f}/{lon:.2f}')
         axes[1].set_ylabel('Altitude [deg]')
-        axes[1].xaxis.set_major_formatter(dformatter)
 
-        
-        axes[2].plot(dates, rads, color='red', label='SUN')
-        axes[2].legend(loc="upper left")    
-        axes[2].grid(which='major', linestyle='-', linewidth=2, axis='both')
-        axes[2].grid(which='minor', linestyle='--', linewidth=1, axis='x')
-        axes[2].minorticks_on()
+        self.rad_line, = axes[2].plot([], [], color='red', label='SUN')
+        axes[2].set_ylabel('Radiation [W/m²]')
 
-        title = f'Direct Radiation '
-        title +=  f' {np.mean(rads):.0f}W/m²^{np.max(rads):.0f}W/m² |'
-        axes[2].set_title(title)
+        self.power_fills = [axes[3].fill_between([0, 1], [0, 0], color='black', label='LOST', alpha = 0.5),
+                            axes[3].fill_between([0, 1], [0, 0], color='magenta', label='BAT', alpha = 0.7),
+                            axes[3].fill_between([0, 1], [0, 0], color='cyan', label='HOUSE', alpha = 0.9)]
+        self.split_line = axes[3].axhline(0, color='cyan', linewidth=2, label='SPLIT')
+        self.inverter_line = axes[3].axhline(0, color='black', linestyle='--', label='INVERTER')
+        self.best_w_line, = axes[3].plot([], [], color='black', linestyle='--', label = "BEST")
+        self.array_lines = [axes[3].plot([], [], linewidth=1, label = array_name)[0]
+                            for array_name in (array_names or [])]
+        self.power_band = axes[3].fill_between([0, 1], [0, 0], color='orange', label='P10-P90',
+                                                alpha = 0.4, zorder = 3)
+        self.power_p50_line, = axes[3].plot([], [], color='darkorange', linestyle=':', label = "P50",
+                                             zorder = 4)
+        axes[3].set_ylabel('Power [W]')
 
-        axes[2].set_ylabel('Radiation [W/m²]')
-        axes[2].xaxis.set_major_formatter(dformatter)
-        
+        self.work_fills = [axes[4].fill_between([0, 1], [0, 0], color='black', label='LOST', alpha = 0.5),
+                           axes[4].fill_between([0, 1], [0, 0], color='magenta', label='BAT', alpha = 0.7),
+                           axes[4].fill_between([0, 1], [0, 0], color='cyan', label='HOUSE', alpha = 0.9)]
+        self.full_line = axes[4].axhline(0, color='magenta', linewidth=2, label='FULL')
+        self.best_wh_line, = axes[4].plot([], [], color='black', linestyle='--', label = "BEST")
+        self.work_band = axes[4].fill_between([0, 1], [0, 0], color='orange', label='P10-P90',
+                                                alpha = 0.4, zorder = 3)
+        self.work_p50_line, = axes[4].plot([], [], color='darkorange', linestyle=':', label = "P50",
+                                             zorder = 4)
+        axes[4].set_ylabel('Work [Wh]')
 
-        axes[3].fill_between(dates, house_w + bat_w + lost_w,
-                             color='black', label='LOST', alpha = 0.5)        
-        axes[3].fill_between(dates, house_w + bat_w,
-                             color='magenta', label='BAT', alpha = 0.7)        
-        axes[3].fill_between(dates, house_w,
-                             color='cyan', label='HOUSE', alpha = 0.9)        
+        self.handles = [None, None, [self.rad_line],
+                        self.power_fills + [self.split_line, self.inverter_line,
+                                            self.best_w_line] + self.array_lines +
+                        [self.power_band, self.power_p50_line],
+                        self.work_fills + [self.full_line, self.best_wh_line,
+                                           self.work_band, self.work_p50_line]]
+
+        for ax in axes:
+            ax.xaxis_date(tzinfo)
+            ax.grid(which='major', linestyle='-', linewidth=2, axis='both')
+            ax.grid(which='minor', linestyle='--', linewidth=1, axis='x')
+            ax.minorticks_on()
+            ax.xaxis.set_major_formatter(dformatter)
+
+
+    def set_fills(self, fills, x, ys):
+        """ Swaps the polygons of the fills between zero and the ys """
+        xs = np.concatenate((x, x[::-1]))
+        for fill, y in zip(fills, ys):
+            if hasattr(fill, 'set_data'):
+                # matplotlib >= 3.10 keeps the limits of fill_between
+                fill.set_data(x, y, 0)
+            else:
+                fill.set_verts([np.column_stack((xs, np.concatenate((y, np.zeros_like(y)))))])
+
+
+    def set_band(self, band, line, x, bands):
+        """ Swaps the polygon of the band between the lowest and the
+        highest of the bands and the line to the middle one. Hidden
+        without bands """
+        band.set_visible(bands is not None)
+        line.set_visible(bands is not None)
+        low, middle, high = bands if bands is not None else (np.zeros_like(x),)*3
+        if hasattr(band, 'set_data'):
+            band.set_data(x, low, high)
+        else:
+            band.set_verts([np.column_stack((np.concatenate((x, x[::-1])),
+                                             np.concatenate((high, low[::-1]))))])
+        line.set_data(x, middle)
+
+
+    @profiled('plot_render')
+    def render(self, pp):
+        """ Swaps the data of the day into the figure """
+        import matplotlib.dates as mdates
+
+        data = pp.data
+        dates = pp.stamps
+        x = mdates.date2num(dates.tz_convert('UTC').tz_localize(None).to_numpy())
+        rads = data['sunrads']
+        best_w = data['best_w']
+        tot_w = data['tot_w']
+        house_w = data['house_w']
+        bat_w = data['bat_w']
+        lost_w = data['lost_w']
+        house_wh = data['house_wh']
+        bat_wh = data['bat_wh']
+        lost_wh = data['lost_wh']
+        best_wh = best_w.cumsum()/60
 
-        if bsplit is not None:
-            axes[3].axhline(bsplit, color='cyan', linewidth=2, label='SPLIT')
+        tot_mean = tot_w.mean()
+        tot_max = tot_w.max()
+        tot_sum = tot_w.sum()/60
+        best_max = best_w.max()
 
-        if ilimit is not None and ilimit < best_max:
-            axes[3].axhline(ilimit, color='black', linestyle='--', label='INVERTER')
+        ilimit = pp.inverter_limit
+        bsplit = pp.battery_split
+        bfull = pp.battery_full
+        axes = self.axes
 
-        axes[3].plot(dates, best_w, color='black', linestyle='--', label = "BEST")
-    
-        axes[3].legend(loc="upper left")    
-        axes[3].grid(which='major', linestyle='-', linewidth=2, axis='both')
-        axes[3].grid(which='minor', linestyle='--', linewidth=1, axis='x')
-        axes[3].minorticks_on()
+        today = dates[0].strftime("%Y-%m-%d")
+        self.text.set_text(f'{self.name} Forecast {today}')
+
+        self.azi_line.set_data(x, data['azimuth'])
+        self.alt_line.set_data(x, data['altitude'])
+        self.rad_line.set_data(x, rads)
+
+        title = f'Direct Radiation '
+        title +=  f' {np.mean(rads):.0f}W/m²^{np.max(rads):.0f}W/m² |'
+        axes[2].set_title(title)
+
+        self.set_fills(self.power_fills, x, (house_w + bat_w + lost_w, house_w + bat_w, house_w))
+        self.split_line.set_visible(bsplit is not None)
+        if bsplit is not None:
+            self.split_line.set_ydata([bsplit, bsplit])
+        self.inverter_line.set_visible(ilimit is not None and ilimit < best_max)
+        if ilimit is not None:
+            self.inverter_line.set_ydata([ilimit, ilimit])
+        self.best_w_line.set_data(x, best_w)
+        for i, array_line in enumerate(self.array_lines):
+            array_line.set_data(x, data[f'tot_w_{i+1}'])
+        has_bands = pp.ensemble is not None
+        self.set_band(self.power_band, self.power_p50_line, x,
+                      [data[f'tot_w_p{p}'] for p in ENSEMBLE_PERCENTILES] if has_bands else None)
 
         title = f'Power Forecast #'
-        title +=  f' {direction:.0f}°/{slope:.0f}°'
-        title +=  f' | {area:.2f}m² | {100*pefficiency:.0f}%'
+        if np.ndim(self.direction) == 0:
+            title +=  f' {self.direction:.0f}°/{self.slope:.0f}°'
+            title +=  f' | {self.area:.2f}m² | {100*pp.efficiency:.0f}%'
+        else:
+            title +=  f' {len(self.direction)} Arrays'
+            title +=  f' | {np.sum(self.area):.2f}m²'
         title +=  f' > {tot_mean:.0f}W^{tot_max:.0f}W'
         axes[3].set_title(title )
-        axes[3].set_ylabel('Power [W]')
-        axes[3].xaxis.set_major_formatter(dformatter)
 
-        
-        axes[4].fill_between(dates, house_wh + bat_wh + lost_wh,
-                             color='black', label='LOST', alpha = 0.5)        
-        axes[4].fill_between(dates, house_wh + bat_wh,
-                             color='magenta', label='BAT', alpha = 0.7)        
-        axes[4].fill_between(dates, house_wh,
-                             color='cyan', label='HOUSE', alpha = 0.9)        
-
-        if bfull is not None and 0 < bat_wh[-1] < bfull:
-            axes[4].axhline(bfull+house_wh[-1], color='magenta', linewidth=2, label='FULL')
-
-        axes[4].plot(dates, best_wh, color='black', linestyle='--', label = "BEST")
-
-        axes[4].legend(loc="upper left")
-        axes[4].grid(which='major', linestyle='-', linewidth=2, axis='both')
-        axes[4].grid(which='minor', linestyle='--', linewidth=1, axis='x')
-        axes[4].minorticks_on()
+        self.set_fills(self.work_fills, x, (house_wh + bat_wh + lost_wh, house_wh + bat_wh, house_wh))
+        self.full_line.set_visible(bfull is not None and 0 < bat_wh[-1] < bfull)
+        if bfull is not None:
+            self.full_line.set_ydata([bfull+house_wh[-1], bfull+house_wh[-1]])
+        self.best_wh_line.set_data(x, best_wh)
+        self.set_band(self.work_band, self.work_p50_line, x,
+                      [data[f'tot_wh_p{p}'] for p in ENSEMBLE_PERCENTILES] if has_bands else None)
+
         title = f'Harvest Forecast #'
         title += f' {house_wh[-1]:.0f}'
         title += f' + {bat_wh[-1]:.0f}'
         title += f' + {lost_wh[-1]:.0f}'
         title += f' = {tot_sum:.0f}Wh'
         axes[4].set_title(title)
-        axes[4].set_ylabel('Work [Wh]')
-        axes[4].xaxis.set_major_formatter(dformatter)
 
+        for ax, handles in zip(axes, self.handles):
+            ax.relim(visible_only = True)
+            for fill in ax.collections:
+                ax.update_datalim(fill.get_paths()[0].vertices)
+            ax.autoscale_view()
+            if handles is not None:
+                ax.legend(handles = [handle for handle in handles if handle.get_visible()],
+                          loc="upper left")
+
+        if not self.laid_out:
+            # tight_layout leaves a placeholder engine which would draw the
+            # figure once more on each save
+            self.fig.tight_layout(pad=2.0)
+            self.fig.set_layout_engine(None)
+            self.laid_out = True
+
+
+    @profiled('plot_save')
+    def save(self, full_save_name, dpi = None):
+        self.fig.savefig(full_save_name, dpi = dpi or 'figure')
+
+
+    def close(self):
+        import_pyplot().close(self.fig)
+
+
+def render_plots(pps, lat, lon, direction, slope, area, full_save_names, dpi = None):
+    """ Saves the plots of the days into PNG files with one figure """
+    renderer = Plot_Renderer(lat, lon, pps[0].name, direction, slope, area,
+                             pps[0].array_names, pps[0].tzinfo)
+    for pp, full_save_name in zip(pps, full_save_names):
+        renderer.render(pp)
+        renderer.save(full_save_name, dpi)
+    renderer.close()
+    return full_save_names
+
+
+def render_plots_pdf(pps, lat, lon, direction, slope, area, full_save_name, dpi = None):
+    """ Saves the plots of the days as pages of one PDF file """
+    from matplotlib.backends.backend_pdf import PdfPages
+
+    renderer = Plot_Renderer(lat, lon, pps[0].name, direction, slope, area,
+                             pps[0].array_names, pps[0].tzinfo)
+    with PdfPages(full_save_name) as pdf:
+        for pp in pps:
+            renderer.render(pp)
+            with profile_stage('plot_save'):
+                pdf.savefig(renderer.fig, dpi = dpi or 'figure')
+    renderer.close()
+
+
+def save_plots(pps, lat, lon, direction, slope, area, full_save_names, dpi = None, jobs = 1):
+    """ Saves the plots of the days into PNG files. Contiguous chunks of
+    the days are rendered in a pool of processes with a figure each """
+    if jobs == 1 or len(pps) < 2:
+        return render_plots(pps, lat, lon, direction, slope, area, full_save_names, dpi)
+
+    chunks = np.array_split(np.arange(len(pps)), min(jobs, len(pps)))
+    with ProcessPoolExecutor(max_workers = len(chunks)) as executor:
+        futures = [executor.submit(render_plots, [pps[i] for i in chunk], lat, lon,
+                                   direction, slope, area,
+                                   [full_save_names[i] for i in chunk], dpi)
+                   for chunk in chunks]
+        return [name for future in futures for name in future.result()]
+
+
+def get_attitude_harvests(tracks, directions, slopes, area, efficiency, bifacial, albedo, system_barrier):
+    """ The harvests in Wh over the sun tracks of all days for the
+    candidate attitudes. All candidates of a day are evaluated at once
+    with the same model as get_array_power in fewer passes """
+    directions, slopes = np.broadcast_arrays(directions, slopes)
+    normals = get_vector(directions.ravel(), slopes.ravel())
+    candidates = np.arange(len(normals))
+    factor = area*efficiency*(1 - albedo)*(1 + albedo)
+
+    harvests = np.zeros(len(normals))
+    for track in tracks:
+        if len(track) == 0:
+            continue
+
+        # Cosines with the front and bifacial radiation from the rear in
+        # the candidates x minutes matrix
+        tot_w = np.dot(normals, np.asarray(track[:,4:7]).T)
+        if bifacial > 0:
+            tot_w = np.where(tot_w >= 0, tot_w, -bifacial*tot_w)
+        else:
+            np.maximum(tot_w, 0, out = tot_w)
+        tot_w *= np.asarray(track[:,3])*factor
+
+        # Consider start barrier. Only the minutes from the first minute
+        # above count which is the second segment of each row
+        above = tot_w >= system_barrier
+        first = above.argmax(axis = 1)
+        segments = np.empty(2*len(candidates), dtype = np.intp)
+        segments[0::2] = candidates*tot_w.shape[1]
+        segments[1::2] = segments[0::2] + first
+        harvest = np.add.reduceat(tot_w.ravel(), segments)[1::2]
+        harvest[~above[candidates, first]] = 0
+
+        harvests += harvest / 60
+    return harvests.reshape(directions.shape)
+
+
+def optimize_attitude(tracks, area, efficiency, bifacial, albedo, system_barrier,
+                      step = 5.0, refine = False):
+    """ The grid of directions, slopes and harvests and the best attitude
+    with its harvest. The best grid point is refined with a pattern search """
+    directions = np.arange(0.0, 360.0, step)
+    slopes = np.arange(0.0, 90.0 + step/2, step)
+    harvests = get_attitude_harvests(tracks, directions[:, None], slopes[None, :],
+                                     area, efficiency, bifacial, albedo, system_barrier)
+
+    i, j = np.unravel_index(np.argmax(harvests), harvests.shape)
+    best = np.array([directions[i], slopes[j]])
+    best_harvest = harvests[i, j]
+
+    delta = step / 2
+    while refine and delta >= 0.1:
+        moves = np.array([(dd, ds) for dd in (-delta, 0, delta) for ds in (-delta, 0, delta)])
+        candidates = best + moves
+        candidates[:, 0] %= 360
+        candidates[:, 1] = np.clip(candidates[:, 1], 0, 90)
+        candidate_harvests = get_attitude_harvests(tracks, candidates[:, 0], candidates[:, 1],
+                                                   area, efficiency, bifacial, albedo, system_barrier)
+        k = np.argmax(candidate_harvests)
+        if candidate_harvests[k] > best_harvest:
+            best, best_harvest = candidates[k], candidate_harvests[k]
+        else:
+            delta /= 2
+
+    return directions, slopes, harvests, best[0], best[1], best_harvest
+
+
+def save_attitude_plot(name, days, directions, slopes, harvests,
+                       best_direction, best_slope, best_harvest, full_save_name):
+    """ Saves the heatmap of the harvests over the attitudes """
+    plt = import_pyplot()
+    fig, ax = plt.subplots(figsize=(9,6))
+    mesh = ax.pcolormesh(directions, slopes, harvests.T/1000, shading='nearest', cmap='viridis')
+    fig.colorbar(mesh, ax=ax, label='Harvest [kWh]')
+    ax.plot(best_direction, best_slope, marker='x', color='red', markersize=12, mew=3)
+    ax.set_xlabel('Direction [deg]')
+    ax.set_ylabel('Slope [deg]')
+
+    period = days[0].strftime("%Y-%m-%d")
+    if len(days) > 1:
+        period += days[-1].strftime(" - %Y-%m-%d")
+    title = f'{name} Attitude {period} #'
+    title += f' {best_direction:.1f}°/{best_slope:.1f}°'
+    title += f' > {best_harvest/1000:.1f}kWh'
+    ax.set_title(title)
+
+    fig.tight_layout()
+    fig.savefig(full_save_name)
+    plt.close(fig)
+
+
+CALIBRATE_GROUPS = ('day', 'season', 'all')
+SEASONS = ('winter', 'winter', 'spring', 'spring', 'spring', 'summer',
+           'summer', 'summer', 'autumn', 'autumn', 'autumn', 'winter')
+
+
+def load_measured(full_load_name, tzinfo):
+    """ The measured harvest of the first column. Either the energies
+    of days [Wh] or the powers of minutes [W] and True for days """
+    df = pd.read_csv(full_load_name, index_col = 0, parse_dates = True)
+    measured = df.iloc[:, 0].astype(float).dropna()
+    index = pd.DatetimeIndex(measured.index)
+    index = index.tz_localize(tzinfo) if index.tz is None else index.tz_convert(tzinfo)
+    measured.index = index
+    is_daily = bool((index == index.normalize()).all() and index.normalize().is_unique)
+    return measured, is_daily
+
+
+def get_delivered_power(track, efficiencies, bifacials, albedos, direction, slope, area,
+                        system_barrier, inverter_limit, battery_split, battery_full, battery_first):
+    """ The power delivered to the house and the battery as candidates x
+    minutes matrix and the energy of the day [Wh] of each candidate for
+    the candidate efficiencies, bifacials and albedos. The energy is that
+    of the forecast with the battery clipped when full. The panel is
+    computed once for the unit efficiency """
+    _, unit_w = get_array_power(np.asarray(track[:,3]), np.asarray(track[:,4:7]),
+                                direction, slope, area, 1.0, [0.0, 1.0], 0.0)
+    front_w, rear_w = unit_w[:,0], unit_w[:,1] - unit_w[:,0]
+
+    tot_w = front_w + bifacials[:, None]*rear_w
+    tot_w *= (efficiencies*(1 - albedos)*(1 + albedos))[:, None]
+    apply_barrier(tot_w, system_barrier)
+
+    house_w, bat_w, lost_w, house_wh, bat_wh, lost_wh = \
+        get_dispatch(tot_w, inverter_limit, battery_split, battery_full, battery_first)
+    return house_w + bat_w, house_wh[:, -1] + bat_wh[:, -1]
+
+
+def get_calibration_errors(tracks, stamps, measures, labels, is_daily, efficiencies,
+                           bifacials, albedos, *panel):
+    """ The sums of squared errors and the modeled energies [Wh] of all
+    candidates for each label of the days """
+    errors, models = {}, {}
+    for track, day_stamps, measure, label in zip(tracks, stamps, measures, labels):
+        if len(track) == 0:
+            continue
+        delivered_w, model = get_delivered_power(track, efficiencies, bifacials, albedos, *panel)
+        if is_daily:
+            error = (model - measure)**2
+        else:
+            minutes = day_stamps[np.asarray(track[:,0]).astype(int)]
+            measure = measure.reindex(minutes).to_numpy()
+            valid = ~np.isnan(measure)
+            error = ((delivered_w[:, valid] - measure[valid])**2).sum(axis = 1)
+        errors[label] = errors.get(label, 0) + error
+        models[label] = models.get(label, 0) + model
+    return errors, models
+
+
+def calibrate_efficiency(tracks, stamps, measures, labels, is_daily, bifacials, albedos,
+                         *panel, step = 0.02):
+    """ The best efficiency, bifacial and albedo with the modeled energy
+    for each label. The efficiency is searched on a grid in steps over
+    all candidates at once and refined in steps of a tenth """
+    efficiencies, bifacials, albedos = (grid.ravel() for grid in np.meshgrid(
+        np.arange(step, 1.0 + step/2, step), bifacials, albedos, indexing = 'ij'))
+    errors, models = get_calibration_errors(tracks, stamps, measures, labels, is_daily,
+                                            efficiencies, bifacials, albedos, *panel)
+
+    results = {}
+    for label, error in errors.items():
+        k = np.argmin(error)
+        fine = np.clip(efficiencies[k] + np.arange(-1.0, 1.0 + 0.05, 0.1)*step, 0.0, 1.0)
+        label_tracks = [(track, day_stamps, measure) for track, day_stamps, measure, day_label
+                        in zip(tracks, stamps, measures, labels) if day_label == label]
+        fine_errors, fine_models = get_calibration_errors(
+            *zip(*label_tracks), [label]*len(label_tracks), is_daily, fine,
+            np.full_like(fine, bifacials[k]), np.full_like(fine, albedos[k]), *panel)
+        f = np.argmin(fine_errors[label])
+        results[label] = (fine[f], bifacials[k], albedos[k], fine_models[label][f], fine_errors[label][f])
+    return results
+
+
+def summarize_days(pps):
+    """ Logs the totals of the forecasts over several days """
+    house_wh = sum(pp.data['house_wh'][-1] for pp in pps)
+    bat_wh = sum(pp.data['bat_wh'][-1] for pp in pps)
+    lost_wh = sum(pp.data['lost_wh'][-1] for pp in pps)
+    tot_wh = sum(pp.data['tot_w'].sum()/60 for pp in pps)
+
+    text = f'Days # From:"{pps[0].day.strftime("%Y-%m-%d")}",'
+    text += f' To:"{pps[-1].day.strftime("%Y-%m-%d")}",'
+    text += f' "{len(pps)}d"'
+    logger.info(text)
+    text = f'Days # House:"{house_wh/1000:.1f}kWh",'
+    text += f' Bat:"{bat_wh/1000:.1f}kWh",'
+    text += f' Lost:"{lost_wh/1000:.1f}kWh",'
+    text += f' Total:"{tot_wh/1000:.1f}kWh"'
+    logger.info(text)
+
+
+""" The aggregation streams the days through accumulators of the days,
+months, years and all days. Only the running figures of the open periods
+are kept, the minutes of a day are dropped once its totals are taken.
+The memory is the same for a month and for decades """
+
+AGGREGATE_LEVELS = ('day', 'month', 'year', 'all')
+AGGREGATE_FORMATS = {'day': '%Y-%m-%d', 'month': '%Y-%m', 'year': '%Y'}
+
+
+class Yield_Accumulator(object):
+    """ The running totals, maxima and sun figures of the days of a period """
+
+    __slots__ = ('period', 'days', 'no_harvest_days', 'sun_days', 'sun_minutes', 'harvest_minutes',
+                 'sun_wh_m2', 'max_w', 'tot_wh', 'house_wh', 'bat_wh', 'lost_wh',
+                 'rise_sum', 'set_sum', 'first_rise', 'last_set')
+
+    def __init__(self, period):
+        self.period = period
+        self.days = self.no_harvest_days = self.sun_days = 0
+        self.sun_minutes = self.harvest_minutes = 0
+        self.sun_wh_m2 = self.max_w = self.tot_wh = self.house_wh = self.bat_wh = self.lost_wh = 0.0
+        self.rise_sum = self.set_sum = 0
+        self.first_rise = self.last_set = None
+
+
+    def add(self, totals):
+        """ Adds the totals of a day of Panel_Power.get_totals """
+        self.days += 1
+        self.no_harvest_days += totals['harvest_minutes'] == 0
+        self.sun_minutes += totals['sun_minutes']
+        self.harvest_minutes += totals['harvest_minutes']
+        self.sun_wh_m2 += totals['sun_wh_m2']
+        self.max_w = max(self.max_w, totals['max_w'])
+        self.tot_wh += totals['tot_wh']
+        self.house_wh += totals['house_wh']
+        self.bat_wh += totals['bat_wh']
+        self.lost_wh += totals['lost_wh']
+        if totals['sun_rise'] is not None:
+            self.sun_days += 1
+            self.rise_sum += totals['sun_rise']
+            self.set_sum += totals['sun_set']
+            # A rise at midnight is minute 0, not unset
+            if self.first_rise is None or totals['sun_rise'] < self.first_rise:
+                self.first_rise = totals['sun_rise']
+            if self.last_set is None or totals['sun_set'] > self.last_set:
+                self.last_set = totals['sun_set']
+
+
+    def get_row(self):
+        """ The figures of the period. The times are the minutes of the day as HH:MM """
+        hhmm = lambda minute: None if minute is None else f'{int(minute)//60:02d}:{int(minute)%60:02d}'
+        mean = lambda total: None if self.sun_days == 0 else round(total/self.sun_days)
+        return {'period': self.period,
+                'days': self.days,
+                'no_harvest_days': self.no_harvest_days,
+                'sun_rise': hhmm(mean(self.rise_sum)),
+                'sun_set': hhmm(mean(self.set_sum)),
+                'first_rise': hhmm(self.first_rise),
+                'last_set': hhmm(self.last_set),
+                'sun_h': self.sun_minutes/60,
+                'harvest_h': self.harvest_minutes/60,
+                'sun_wh_m2': self.sun_wh_m2,
+                'mean_w': self.tot_wh*60/max(self.sun_minutes, 1),
+                'max_w': self.max_w,
+                'tot_wh': self.tot_wh,
+                'house_wh': self.house_wh,
+                'bat_wh': self.bat_wh,
+                'lost_wh': self.lost_wh}
+
+
+def aggregate_yields(totals, levels = AGGREGATE_LEVELS):
+    """ Streams the totals of the days in order into an accumulator for
+    each level. Yields the level and the row of a period once complete """
+    accumulators = {}
+    for day_totals in totals:
+        for level in levels:
+            period = 'all' if level == 'all' else day_totals['day'].strftime(AGGREGATE_FORMATS[level])
+            accumulator = accumulators.get(level)
+            if accumulator is not None and accumulator.period != period:
+                yield level, accumulator.get_row()
+                accumulator = None
+            if accumulator is None:
+                accumulator = accumulators[level] = Yield_Accumulator(period)
+            accumulator.add(day_totals)
+    for level in levels:
+        if level in accumulators:
+            yield level, accumulators[level].get_row()
+
+
+def iter_totals(pps, dataset = None):
+    """ The totals of the forecasts. The minutes are appended to the
+    dataset before they are dropped """
+    for pp in pps:
+        if dataset is not None:
+            append_dataset(pp.df, *dataset)
+        yield pp.get_totals()
+
+
+def log_yield(level, row):
+    """ Logs the figures of a year or of all days """
+    text = f'{level.capitalize()} #'
+    if level != 'all':
+        text += f' "{row["period"]}",'
+    text += f' Days:"{row["days"]}",'
+    text += f' Harvest:"{row["harvest_h"]:.0f}h",'
+    text += f' Sun:"{row["sun_wh_m2"]/1000:.1f}kWh/m²",'
+    text += f' Rise:"{row["sun_rise"]}", Set:"{row["sun_set"]}"'
+    logger.info(text)
+    text = f'{level.capitalize()} # House:"{row["house_wh"]/1000:.1f}kWh",'
+    text += f' Bat:"{row["bat_wh"]/1000:.1f}kWh",'
+    text += f' Lost:"{row["lost_wh"]/1000:.1f}kWh",'
+    text += f' Total:"{row["tot_wh"]/1000:.1f}kWh",'
+    text += f' Max:"{row["max_w"]:.0f}W"'
+    logger.info(text)
 
-        fig.tight_layout(pad=2.0)
 
-        fig.savefig(full_save_name)
-        plt.close(fig) 
-        #plt.show()
+ROLLING_KEYS = ('bat_wh', 'house_wh')
+
+
+class Rolling_Forecast(object):
+    """ The remaining day of a forecast advanced minute by minute. The
+    prefix sums of the charge and of the house power while charging and
+    when the battery is full are built once. A tick is a few lookups in
+    them. An observed battery level or house energy replaces the running
+    state and only searches the minute the battery is full again """
+
+    __slots__ = ('stamps', 'minutes', 'positions', 'battery_full', 'charge', 'house',
+                 'house_full', 'total', 'position', 'start', 'start_level', 'start_house',
+                 'full_position', 'full_minute')
+
+    def __init__(self, pp):
+        data = pp.data
+        tot_w = data['tot_w'][None, :]
+        # The dispatch of an empty battery without limit of the energy
+        house_w, bat_w, _, _, _, _ = get_dispatch(tot_w, pp.inverter_limit, pp.battery_split,
+                                                  None, pp.battery_first)
+        house_full_w = house_w
+        if pp.battery_first:
+            house_full_w, _, _, _, _, _ = get_dispatch(tot_w, pp.inverter_limit, None, None, False)
+
+        prefix = lambda w: np.concatenate(([0.0], w[0].cumsum()/60))
+        self.charge = prefix(bat_w)
+        self.house = prefix(house_w)
+        self.house_full = prefix(house_full_w)
+        self.total = prefix(tot_w)
+
+        self.stamps = get_day_stamps(pp.day, pp.tzinfo)
+        self.minutes = pp.minutes
+        # The number of sun minutes up to each minute of the day
+        self.positions = np.searchsorted(pp.minutes, np.arange(24*60), side = 'right')
+        self.battery_full = pp.battery_full
+        self.position = 0
+        self.observe(0.0, 0.0)
+
+    def observe(self, bat_wh = None, house_wh = None):
+        """ Replaces the battery level and the house energy of the day
+        with observed values [Wh] """
+        house_wh = self.get_house() if house_wh is None else house_wh
+        bat_wh = self.get_level() if bat_wh is None else bat_wh
+        if self.battery_full is not None:
+            bat_wh = min(max(bat_wh, 0.0), self.battery_full)
+        self.start, self.start_level, self.start_house = self.position, bat_wh, house_wh
+
+        # The first sun minute charging to full, all minutes if never
+        self.full_position = len(self.charge) - 1
+        self.full_minute = None
+        if self.battery_full is not None:
+            target = self.battery_full - bat_wh + self.charge[self.start]
+            full = np.searchsorted(self.charge, target, side = 'left') - 1
+            self.full_position = int(min(max(full, self.start), self.full_position))
+            if bat_wh >= self.battery_full:
+                # Observed full since the last sun minute passed
+                self.full_minute = int(self.minutes[self.start - 1]) if self.start > 0 else 0
+            elif self.full_position < len(self.charge) - 1:
+                self.full_minute = int(self.minutes[self.full_position])
+
+    def advance(self, minute):
+        """ Passes the sun minutes up to the minute of the day """
+        self.position = max(int(self.positions[minute]), self.start)
+
+    def get_level(self):
+        level = self.start_level + self.charge[self.position] - self.charge[self.start]
+        return level if self.battery_full is None else min(level, self.battery_full)
+
+    def get_house(self):
+        p, full = self.position, max(self.full_position, self.start)
+        return (self.start_house + self.house[min(p, full)] - self.house[self.start] +
+                self.house_full[max(p, full)] - self.house_full[full])
+
+    def get_update(self, minute):
+        """ The figures so far, the remaining and the expected ones of the
+        day at the minute """
+        p, full, end = self.position, self.full_position, len(self.charge) - 1
+        house_wh, bat_wh = self.get_house(), self.get_level()
+        remaining_house = (self.house[max(p, full)] - self.house[p] +
+                           self.house_full[end] - self.house_full[max(p, full)])
+        remaining_bat = self.charge[max(p, full)] - self.charge[p]
+        remaining_lost = max(self.total[end] - self.total[p] - remaining_house - remaining_bat, 0.0)
+        expected_bat = bat_wh + self.charge[end] - self.charge[p]
+        if self.battery_full is not None:
+            expected_bat = min(expected_bat, self.battery_full)
+
+        return {'time': self.stamps[minute].isoformat(),
+                'house_wh': float(house_wh),
+                'bat_wh': float(bat_wh),
+                'remaining_house_wh': float(remaining_house),
+                'remaining_bat_wh': float(remaining_bat),
+                'remaining_lost_wh': float(remaining_lost),
+                'expected_house_wh': float(house_wh + remaining_house),
+                'expected_bat_wh': float(expected_bat),
+                'battery_full': None if self.full_minute is None else self.stamps[self.full_minute].isoformat(),
+                'minutes_to_full': None if self.full_minute is None else int(max(self.full_minute - minute, 0))}
+
+
+def iter_rolling(pp, minutes = None):
+    """ The updates of the remaining day for the minutes of the day in
+    order, all minutes with sun by default. A dict of observed 'bat_wh'
+    and 'house_wh' sent into the generator replaces the running state
+    before the next minute """
+    rolling = Rolling_Forecast(pp)
+    if minutes is None:
+        minutes = pp.minutes
+    for minute in minutes:
+        rolling.advance(minute)
+        observation = yield rolling.get_update(minute)
+        if observation:
+            rolling.observe(**{key: observation[key] for key in ROLLING_KEYS if key in observation})
+
+
+def read_observations(stream, observations, tzinfo):
+    """ Puts the minutes of the day and the values of the JSON lines of
+    the stream into the queue. The time is 'HH:MM' or a timestamp, the
+    minute is None without. Invalid lines are skipped """
+    for line in stream:
+        try:
+            observation = json.loads(line)
+            minute = None
+            if observation.get('time') is not None:
+                stamp = datetime.strptime(observation['time'], '%H:%M') \
+                    if len(observation['time']) <= 5 else pd.Timestamp(observation['time'])
+                if stamp.tzinfo is not None:
+                    stamp = stamp.astimezone(tzinfo)
+                minute = stamp.hour*60 + stamp.minute
+            observations.put((minute, {key: float(observation[key])
+                                       for key in ROLLING_KEYS if key in observation}))
+        except (ValueError, TypeError, AttributeError) as e:
+            logger.error(f'The observation is skipped "{line.strip()}": {e}')
+
+
+DATA_FORMATS = ('csv', 'parquet', 'feather', 'npz')
+
+
+def get_npz_column(column):
+    """ The values of the column without objects. Stamps are UTC """
+    if isinstance(column.dtype, pd.DatetimeTZDtype):
+        return column.dt.tz_convert('UTC').dt.tz_localize(None).to_numpy('datetime64[ns]')
+    if column.dtype == object:
+        return column.to_numpy(dtype = str)
+    return column.to_numpy()
+
+
+@profiled('save_data')
+def save_data(df, full_save_name, data_format = 'csv', float32 = False):
+    """ Saves the minutes in the format. Parquet and Feather are
+    compressed with zstd and need pyarrow """
+    if float32:
+        df = df.astype({column: np.float32 for column in df.columns
+                        if df[column].dtype == np.float64})
+
+    if data_format == 'parquet':
+        df.to_parquet(full_save_name, compression = 'zstd')
+    elif data_format == 'feather':
+        df.reset_index(names = 'time').to_feather(full_save_name, compression = 'zstd')
+    elif data_format == 'npz':
+        # The stamps are UTC with the offset of each row and the name of the zone if any
+        tz = df.index.tz
+        with open(full_save_name, 'wb') as f:
+            np.savez_compressed(f,
+                                time = df.index.tz_convert('UTC').tz_localize(None).to_numpy('datetime64[ns]'),
+                                utcoffset = np.array([stamp.utcoffset().total_seconds() for stamp in df.index]),
+                                tz = getattr(tz, 'key', None) or getattr(tz, 'zone', None) or '',
+                                **{column: get_npz_column(df[column]) for column in df.columns})
+    else:
+        df.to_csv(full_save_name)
+
+
+def load_data(full_load_name):
+    """ The minutes saved in the format of the extension """
+    ext = os.path.splitext(full_load_name)[1]
+    if ext == '.parquet':
+        return pd.read_parquet(full_load_name)
+    if ext == '.feather':
+        return pd.read_feather(full_load_name).set_index('time')
+    if ext == '.npz':
+        with np.load(full_load_name) as data:
+            index = pd.DatetimeIndex(data['time']).tz_localize('UTC')
+            offsets = np.unique(data['utcoffset'])
+            if 'tz' in data.files and str(data['tz']) != '':
+                index = index.tz_convert(str(data['tz']))
+            elif len(offsets) == 1:
+                index = index.tz_convert(timezone(timedelta(seconds = float(offsets[0]))))
+            else:
+                # Several fixed offsets without zone keep the wall clock of each row
+                index = pd.Index([stamp.tz_convert(timezone(timedelta(seconds = float(offset))))
+                                  for stamp, offset in zip(index, data['utcoffset'])])
+            return pd.DataFrame({column: data[column] for column in data.files
+                                 if column not in ('time', 'utcoffset', 'tz')}, index = index)
+    df = pd.read_csv(full_load_name, index_col = 0)
+    df.index = pd.to_datetime(df.index)
+    return df
+
+
+def append_dataset(df, directory, name, data_format = 'parquet', float32 = False):
+    """ Appends the minutes to the dataset partitioned by panel, year and
+    month with a file for each day. Days saved before are replaced """
+    panel = name.replace(' ', '_')
+    for day, day_df in df.groupby(df.index.date):
+        partition = os.path.join(directory, f'panel={panel}',
+                                 f'year={day.year}', f'month={day.month:02d}')
+        os.makedirs(partition, exist_ok = True)
+        full_save_name = os.path.join(partition, day.strftime('%y%m%d.') + data_format)
+        temp_save_name = f'{full_save_name}.{os.getpid()}.tmp'
+        save_data(day_df, temp_save_name, data_format, float32)
+        # The day saved before in another format is replaced too
+        for other_format in DATA_FORMATS:
+            if other_format != data_format:
+                try:
+                    os.remove(os.path.join(partition, day.strftime('%y%m%d.') + other_format))
+                except FileNotFoundError:
+                    pass
+        os.replace(temp_save_name, full_save_name)
+
+
+def load_dataset(directory, name = None):
+    """ The minutes of all days in the dataset, of all panels or the named """
+    dfs = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for file in sorted(files):
+            if os.path.splitext(file)[1][1:] not in DATA_FORMATS:
+                continue
+            panel = os.path.relpath(root, directory).split(os.sep)[0].split('=', 1)[-1]
+            if name is not None and panel != name.replace(' ', '_'):
+                continue
+            df = load_data(os.path.join(root, file))
+            df['panel'] = panel
+            dfs.append(df)
+    return pd.concat(dfs) if len(dfs) > 0 else pd.DataFrame()
+
+
+def benchmark_data(df, directory):
+    """ Logs the times to write and read the minutes and the sizes in all
+    formats with and without float32 """
+    for data_format in DATA_FORMATS:
+        for float32 in (False, True):
+            full_save_name = os.path.join(directory, 'benchmark.' + data_format)
+            try:
+                begin = time.perf_counter()
+                save_data(df, full_save_name, data_format, float32)
+                written = time.perf_counter()
+                load_data(full_save_name)
+                read = time.perf_counter()
+            except ImportError as e:
+                logger.info(f'Data # "{data_format}" not available: {e}')
+                break
+            size = os.path.getsize(full_save_name)
+            os.remove(full_save_name)
+
+            text = f'Data # "{data_format}{"/float32" if float32 else ""}",'
+            text += f' Write:"{written - begin:.3f}s",'
+            text += f' Read:"{read - written:.3f}s",'
+            text += f' Size:"{size/2**20:.2f}MB"'
+            logger.info(text)
+
+
+def get_clipped_cumsum(increments, start, capacity, chunk = 24*60, min_chunk = 16):
+    """ The running sum of the increments clipped to [0, capacity] after
+    each step. The sum is vectorized in chunks up to the next step which
+    hits a bound. While a bound holds, the steps are skipped up to the next
+    increment leaving it. A chunk is twice the distance of the last hit,
+    so frequent hits do not sum the whole chunk each time """
+    levels = np.empty_like(increments)
+    falls = np.flatnonzero(increments < 0)
+    rises = np.flatnonzero(increments > 0)
+    level, t, n = min(max(start, 0), capacity), 0, len(increments)
+    window = chunk
+    while t < n:
+        if level >= capacity or level <= 0:
+            leaves = falls if level >= capacity else rises
+            i = np.searchsorted(leaves, t)
+            stop = leaves[i] if i < len(leaves) else n
+            levels[t:stop] = level
+            t = stop
+            if t >= n:
+                break
+
+        sums = level + np.cumsum(increments[t:t + window])
+        out = (sums > capacity) | (sums < 0)
+        if not out.any():
+            levels[t:t + len(sums)] = sums
+            level = sums[-1]
+            t += len(sums)
+            window = min(2*window, chunk)
+            continue
+
+        k = out.argmax()
+        window = min(max(2*(k + 1), min_chunk), chunk)
+        levels[t:t + k] = sums[:k]
+        level = min(max(sums[k], 0), capacity)
+        levels[t + k] = level
+        t += k + 1
+    return levels
+
+
+@profiled('load_dispatch')
+def get_load_dispatch(tot_w, load_w, inverter_limit, battery_full,
+                      battery_charge, battery_discharge, battery_start):
+    """ The power for the house, the battery, the lost and the grid with
+    the state of charge carried over all minutes of several days. The PV
+    serves the house first, the surplus charges the battery and the rest
+    is exported. The battery serves the house without PV """
+    inverter = np.inf if inverter_limit is None else inverter_limit
+    capacity = 0.0 if battery_full is None else battery_full
+
+    direct_w = np.minimum(np.minimum(tot_w, load_w), inverter)
+    excess_w = tot_w - direct_w
+    deficit_w = np.minimum(load_w - direct_w, inverter - direct_w)
+    charge_w = excess_w if battery_charge is None else np.minimum(excess_w, battery_charge)
+    discharge_w = deficit_w if battery_discharge is None else np.minimum(deficit_w, battery_discharge)
+
+    if capacity <= 0:
+        # Without battery nothing is stored
+        soc_wh = np.zeros_like(tot_w)
+        bat_w = np.zeros_like(tot_w)
+    else:
+        soc_wh = get_clipped_cumsum((charge_w - discharge_w)/60, battery_start, capacity)
+        bat_w = np.diff(soc_wh, prepend = min(max(battery_start, 0), capacity))*60
+
+    house_w = direct_w + np.maximum(-bat_w, 0)
+    export_w = np.maximum(np.minimum(excess_w - np.maximum(bat_w, 0), inverter - house_w), 0)
+    lost_w = np.maximum(excess_w - np.maximum(bat_w, 0) - export_w, 0)
+    import_w = np.maximum(load_w - house_w, 0)
+
+    return house_w, bat_w, lost_w, import_w, export_w, soc_wh
+
+
+def load_load(load, stamps):
+    """ The house load [W] for the stamps. Either a constant power, a CSV
+    with the hours of a day [0 - 24] or a CSV with timestamps in the first
+    column and the power in the second """
+    try:
+        return np.full(len(stamps), float(load))
+    except ValueError:
+        pass
+
+    df = pd.read_csv(load, index_col = 0)
+    power = df.iloc[:, 0].astype(float).to_numpy()
+    if pd.api.types.is_numeric_dtype(df.index):
+        # A daily profile repeated for all days
+        hours = (stamps.hour + stamps.minute/60).to_numpy()
+        return np.interp(hours, df.index.to_numpy(dtype = float), power, period = 24)
+
+    index = pd.DatetimeIndex(pd.to_datetime(df.index))
+    index = index.tz_localize(stamps.tz) if index.tz is None else index.tz_convert(stamps.tz)
+    seconds = lambda stamps: (stamps - pd.Timestamp(0, tz='UTC')).total_seconds().to_numpy()
+    return np.interp(seconds(stamps), seconds(index), power)
+
+
+""" The weather attenuates the clear sky radiation of the sun track. A
+weather file has the timestamps in the first column and either a
+'factor' column with the share of the clear sky radiation [%] or a
+'cloud' column with the cloud cover [%] converted with Kasten and
+Czeplak, 1 - 0.75*cover**3.4. The series is read in chunks and only the
+rows of the forecast days with a margin are kept, so archives of many
+years are never loaded as a whole. Parquet files are memory mapped and
+read by row groups. The rows are expected in time order. The factors
+are linearly interpolated to the minutes. Minutes outside the series
+have clear sky """
+
+WEATHER_CHUNK = 2**16 # rows
+WEATHER_MARGIN = 86400 # s
+
+
+def iter_weather(full_load_name, chunk = WEATHER_CHUNK):
+    """ The chunks of the weather file as DataFrames """
+    if os.path.splitext(full_load_name)[1].lower() == '.parquet':
+        import pyarrow.parquet as pq
+        parquet = pq.ParquetFile(full_load_name, memory_map = True)
+        for batch in parquet.iter_batches(batch_size = chunk):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(full_load_name, chunksize = chunk)
+
+
+def get_weather_seconds(values, tzinfo):
+    """ The POSIX seconds of the timestamps, local without a timezone """
+    index = pd.DatetimeIndex(pd.to_datetime(values))
+    if index.tz is None:
+        index = index.tz_localize(tzinfo)
+    return index.as_unit('ns').asi8 / 1e9
+
+
+def get_weather_factor(df):
+    """ The share of the clear sky radiation of the weather rows """
+    if 'factor' in df:
+        return df['factor'].to_numpy(dtype = float)/100
+    if 'cloud' in df:
+        return 1 - 0.75*np.clip(df['cloud'].to_numpy(dtype = float)/100, 0, 1)**3.4
+    raise ValueError('The weather has no column "factor" or "cloud"')
+
+
+def load_weather(full_load_name, days, tzinfo = None):
+    """ The weather factors of the minutes of the days as days x minutes
+    matrix. NaN outside the series """
+    stamps = [get_day_stamps(day, tzinfo) for day in days]
+    seconds = np.concatenate([day_stamps.asi8 for day_stamps in stamps]) / 1e9
+    begin, end = seconds.min() - WEATHER_MARGIN, seconds.max() + WEATHER_MARGIN
+
+    rows, factors = [np.zeros(0)], [np.zeros(0)]
+    for df in iter_weather(full_load_name):
+        if len(df) == 0 or get_weather_seconds(df.iloc[-1:, 0], stamps[0].tz)[0] < begin:
+            # Chunks before the days are not parsed
+            continue
+        row_seconds = get_weather_seconds(df.iloc[:, 0], stamps[0].tz)
+        keep = (row_seconds >= begin) & (row_seconds <= end)
+        rows.append(row_seconds[keep])
+        factors.append(get_weather_factor(df)[keep])
+        if len(row_seconds) > 0 and row_seconds.min() > end:
+            break
+
+    rows, factors = np.concatenate(rows), np.concatenate(factors)
+    valid = ~np.isnan(factors)
+    rows, factors = rows[valid], np.clip(factors[valid], 0, None)
+    if len(rows) == 0:
+        return np.full((len(days), 24*60), np.nan)
+    order = np.argsort(rows, kind = 'stable')
+    weather = np.interp(seconds, rows[order], factors[order], left = np.nan, right = np.nan)
+    return weather.reshape(len(days), -1)
+
+
+def summarize_weather(weathers):
+    """ Logs the coverage and the mean factor of the weather """
+    covered = ~np.isnan(weathers)
+    text = f'Weather # Covered:"{100*covered.mean():.0f}%",'
+    text += f' Days:"{covered.any(axis = 1).sum()}/{len(weathers)}",'
+    text += f' Mean:"{100*np.nanmean(weathers) if covered.any() else 100:.0f}%"'
+    logger.info(text)
 
 
-    def save_csv(self, full_save_name):
-        self.df.to_csv(full_save_name)
+def get_day_minutes(pps):
+    """ The stamps and the total power of all minutes of the days """
+    stamps, tot_w = [], []
+    for pp in pps:
+        day_stamps = get_day_stamps(pp.day, pp.tzinfo)
+        day_w = np.zeros(len(day_stamps))
+        day_w[pp.minutes] = pp.data['tot_w']
+        stamps.append(day_stamps)
+        tot_w.append(day_w)
+    return stamps[0].append(stamps[1:]), np.concatenate(tot_w)
+
+
+def summarize_load_dispatch(df):
+    """ Logs the totals of the dispatch with the house load """
+    load_wh = df.load_w.sum()/60
+    import_wh = df.import_w.sum()/60
+    text = f'Dispatch # Load:"{load_wh/1000:.1f}kWh",'
+    text += f' House:"{df.house_w.sum()/60000:.1f}kWh",'
+    text += f' Import:"{import_wh/1000:.1f}kWh",'
+    text += f' Export:"{df.export_w.sum()/60000:.1f}kWh",'
+    text += f' Lost:"{df.lost_w.sum()/60000:.1f}kWh"'
+    logger.info(text)
+    text = f'Dispatch # Autarky:"{100*(1 - import_wh/load_wh) if load_wh > 0 else 100:.0f}%",'
+    text += f' Battery Cycles:"{df.bat_w.clip(lower = 0).sum()/60/max(df.soc_wh.max(), 1):.0f}",'
+    text += f' End:"{df.soc_wh.iloc[-1]:.0f}Wh"'
+    logger.info(text)
+
+
+def get_load_dispatch_df(pps, load, inverter_limit, battery_full,
+                         battery_charge, battery_discharge, battery_start):
+    """ The dispatch of all minutes of the days with the house load """
+    stamps, tot_w = get_day_minutes(pps)
+    load_w = load_load(load, stamps)
+    house_w, bat_w, lost_w, import_w, export_w, soc_wh = get_load_dispatch(
+        tot_w, load_w, inverter_limit, battery_full, battery_charge, battery_discharge, battery_start)
+    data = {'tot_w':tot_w, 'load_w':load_w, 'house_w':house_w, 'bat_w':bat_w,
+            'lost_w':lost_w, 'import_w':import_w, 'export_w':export_w, 'soc_wh':soc_wh,
+            'house_wh':house_w.cumsum()/60, 'bat_wh':bat_w.cumsum()/60,
+            'lost_wh':lost_w.cumsum()/60, 'import_wh':import_w.cumsum()/60,
+            'export_wh':export_w.cumsum()/60}
+    return pd.DataFrame(data = data, index = stamps)
+
+
+""" The fleet mode forecasts the sites of a table. The sun track, the
+power and the dispatch are computed for a chunk of sites times the
+minutes of the day with array operations. The astronomy of the minutes
+is shared by the sites, only the hour angle, the parallax and the
+horizon depend on the site. Each site has one panel array and the same
+model as Panel_Power. The sites are sorted by longitude, so the sun is
+up in the same minutes for the sites of a chunk. The minutes are
+sampled every FLEET_SAMPLE minutes and only the minutes next to a
+sample with the sun above FLEET_ALTITUDE for any site are evaluated """
+
+FLEET_KEYS = ('panel_name', 'lat', 'lon', 'direction', 'slope', 'area', 'efficiency',
+              'bifacial', 'albedo', 'system_barrier', 'inverter_limit',
+              'battery_split', 'battery_full', 'battery_first')
+FLEET_RANGES = {'lat': (-90, 90), 'lon': (-180, 180), 'direction': (0, 360), 'slope': (0, 360),
+                'area': (0, np.inf), 'efficiency': (0, 100), 'bifacial': (0, 60), 'albedo': (0, 30),
+                'system_barrier': (0, np.inf), 'inverter_limit': (0, 800),
+                'battery_split': (0, np.inf), 'battery_full': (0, np.inf)}
+FLEET_SAMPLE = 15 # min
+FLEET_ALTITUDE = -4.0 # deg, the sun rises less than 0.25° per minute
+
+
+def load_fleet(full_load_name, args):
+    """ The sites of a CSV or Parquet table with a row for each site and
+    columns named like the site keys. Missing columns and empty cells
+    default to the arguments. None limits are NaN """
+    ext = os.path.splitext(full_load_name)[1].lower()
+    if ext == '.parquet':
+        table = pd.read_parquet(full_load_name)
+    elif ext == '.csv':
+        table = pd.read_csv(full_load_name)
+    else:
+        raise ValueError(f'Unknown format of the fleet file "{ext}"')
+
+    unknown = set(table.columns) - set(FLEET_KEYS)
+    if unknown:
+        raise ValueError(f'Unknown columns in fleet "{", ".join(sorted(unknown))}"')
+    if len(table) == 0:
+        raise ValueError('The fleet has no sites')
+
+    defaults = {'lat': args.lat, 'lon': args.lon,
+                'direction': args.panel_direction, 'slope': args.panel_slope,
+                'area': args.panel_area, 'efficiency': args.panel_efficiency,
+                'bifacial': args.panel_bifacial, 'albedo': args.panel_albedo,
+                'system_barrier': args.system_barrier, 'inverter_limit': args.inverter_limit,
+                'battery_split': args.battery_split, 'battery_full': args.battery_full,
+                'battery_first': args.battery_first}
+    sites = {}
+    if 'panel_name' in table:
+        names = table['panel_name'].astype(str).to_numpy()
+    else:
+        names = np.array([f'Site {i+1}' for i in range(len(table))])
+    sites['panel_name'] = names
+    for key, default in defaults.items():
+        values = table[key].to_numpy(dtype = float) if key in table else np.full(len(table), np.nan)
+        sites[key] = np.where(np.isnan(values), np.nan if default is None else float(default), values)
+    sites['battery_first'] = sites['battery_first'] > 0
+
+    for key, (low, high) in FLEET_RANGES.items():
+        bad = np.flatnonzero((sites[key] < low) | (sites[key] > high))
+        if len(bad) > 0:
+            raise ValueError(f'The {key} of "{names[bad[0]]}" is out of range "{sites[key][bad[0]]}"')
+    bad = np.flatnonzero(sites['battery_first'] & np.isnan(sites['battery_split'])
+                         & np.isnan(sites['battery_full']))
+    if len(bad) > 0:
+        raise ValueError(f'The combination of battery parameters of "{names[bad[0]]}" is illegal')
+    return sites
+
+
+def get_first_minutes(mask, minutes):
+    """ The first of the minutes true in each row of the mask, -1 without """
+    if len(minutes) == 0:
+        return np.full(len(mask), -1)
+    return np.where(mask.any(axis = 1), minutes[mask.argmax(axis = 1)], -1)
+
+
+@profiled('fleet')
+def get_fleet_chunk(sites, day, float32 = False):
+    """ The summaries of the day for a chunk of sites as columns. The
+    rises and sets are the minutes of the day, -1 without """
+    stamps = get_day_stamps(day)
+    seconds = stamps.asi8 / 1e9
+    utc_days = (stamps.asi8 // (86400*10**9)).astype('datetime64[D]')
+    ydays = (utc_days - utc_days.astype('datetime64[Y]')).astype(int) + 1
+    lat, lon = sites['lat'][:, None], sites['lon'][:, None]
+
+    # The minutes next to a sample with the sun up at any site
+    samples = np.unique(np.append(np.arange(0, len(stamps), FLEET_SAMPLE), len(stamps) - 1))
+    is_up = (get_sun_position_numpy(lat, lon, seconds[samples])[0] > FLEET_ALTITUDE).any(axis = 0)
+    intervals = np.minimum(np.searchsorted(samples, np.arange(len(stamps)), side = 'right') - 1,
+                           len(samples) - 2)
+    minutes = np.flatnonzero(is_up[intervals] | is_up[intervals + 1])
+
+    alts, azis = get_sun_position_numpy(lat, lon, seconds[minutes])
+    rads = get_radiation_direct_numpy(ydays[minutes], alts)
+
+    # Cosines with the panel normals from the components of the sun vectors
+    normals = get_vector(sites['direction'], sites['slope'])[:, :, None]
+    azis, alts = np.radians(azis), np.radians(alts)
+    suncos = np.cos(alts)*(np.sin(azis)*normals[:, 0] + np.cos(azis)*normals[:, 1])
+    suncos += np.sin(alts)*normals[:, 2]
+
+    # The same panel model as get_array_power with a row for each site
+    dtype = np.float32 if float32 else np.float64
+    column = lambda key: sites[key][:, None].astype(dtype)
+    rads, suncos = rads.astype(dtype), suncos.astype(dtype)
+    best_w = rads*column('area')*(column('efficiency')/100)
+    albedos = column('albedo')/100
+    best_w -= albedos*best_w
+    tot_w = best_w*suncos
+    tot_w = np.where(suncos >= 0, tot_w, tot_w*-(column('bifacial')/100))
+    tot_w += albedos*tot_w
+    apply_barrier(tot_w, column('system_barrier'))
+
+    # No limit is infinite and no split for the house first is no battery
+    limit = lambda key: np.where(np.isnan(sites[key]), np.inf, sites[key])[:, None]
+    inverter_limit, battery_split, battery_full = \
+        limit('inverter_limit'), limit('battery_split'), limit('battery_full')
+    first = sites['battery_first']
+    battery_full[np.isnan(sites['battery_split']) & ~first] = 0
+    house_wh, bat_wh, lost_wh = (np.zeros(len(first)) for _ in range(3))
+    for battery_first in (False, True):
+        rows = first == battery_first
+        if rows.any() and len(minutes) > 0:
+            dispatch = get_dispatch(tot_w[rows], inverter_limit[rows], battery_split[rows],
+                                    battery_full[rows], battery_first)
+            house_wh[rows], bat_wh[rows], lost_wh[rows] = (wh[:, -1] for wh in dispatch[3:])
+
+    is_sun = alts > 0
+    is_harvest = tot_w > 0
+    sun_minutes = np.maximum(is_sun.sum(axis = 1), 1)
+    tot_w_sum = tot_w.sum(axis = 1, dtype = np.float64)
+    return {'sun_rise': get_first_minutes(is_sun, minutes),
+            'sun_set': get_first_minutes(is_sun[:, ::-1], minutes[::-1]),
+            'sun_wh_m2': rads.sum(axis = 1, dtype = np.float64)/60,
+            'harvest_rise': get_first_minutes(is_harvest, minutes),
+            'harvest_set': get_first_minutes(is_harvest[:, ::-1], minutes[::-1]),
+            'mean_w': tot_w_sum/sun_minutes,
+            'max_w': tot_w.max(axis = 1, initial = 0).astype(np.float64),
+            'tot_wh': tot_w_sum/60,
+            'house_wh': house_wh,
+            'bat_wh': bat_wh,
+            'lost_wh': lost_wh}
+
+
+def get_fleet_days(sites, days, chunk = 256, float32 = False, jobs = 1):
+    """ The summaries of the days for all sites as DataFrame with a row
+    for each site and day. The chunks of sites are computed in a pool of
+    processes with several jobs """
+    order = np.lexsort((sites['lat'], sites['lon']))
+    chunks = [order[i:i + chunk] for i in range(0, len(order), chunk)]
+    tasks = [({key: values[rows] for key, values in sites.items()}, day)
+             for day in days for rows in chunks]
+    if jobs == 1 or len(tasks) == 1:
+        results = [get_fleet_chunk(chunk_sites, day, float32) for chunk_sites, day in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers = jobs) as executor:
+            results = list(executor.map(get_fleet_chunk, *zip(*tasks), repeat(float32),
+                                        chunksize = max(1, len(tasks) // (4*jobs))))
+
+    dfs = []
+    for i, day in enumerate(days):
+        day_results = results[i*len(chunks):(i + 1)*len(chunks)]
+        data = {key: np.empty(len(order), dtype = values.dtype)
+                for key, values in day_results[0].items()}
+        for rows, result in zip(chunks, day_results):
+            for key, values in result.items():
+                data[key][rows] = values
+
+        stamps = get_day_stamps(day)
+        df = pd.DataFrame({'panel_name': sites['panel_name']},
+                          index = stamps[np.zeros(len(order), dtype = int)].rename('day'))
+        for key, values in data.items():
+            if key.endswith(('_rise', '_set')):
+                values = stamps[np.maximum(values, 0)].where(values >= 0)
+            df[key] = values
+        dfs.append(df)
+    return pd.concat(dfs)
+
+
+def summarize_fleet(df, seconds):
+    """ Logs the totals of the fleet and the rate of site days """
+    sites = df.panel_name.nunique()
+    days = df.index.nunique()
+    text = f'Fleet # Sites:"{sites}",'
+    text += f' Days:"{days}",'
+    text += f' No Harvest:"{df.harvest_rise.isna().sum()}"'
+    logger.info(text)
+    text = f'Fleet # House:"{df.house_wh.sum()/1000:.1f}kWh",'
+    text += f' Bat:"{df.bat_wh.sum()/1000:.1f}kWh",'
+    text += f' Lost:"{df.lost_wh.sum()/1000:.1f}kWh",'
+    text += f' Total:"{df.tot_wh.sum()/1000:.1f}kWh"'
+    logger.info(text)
+    text = f'Fleet # Time:"{seconds:.2f}s",'
+    text += f' Rate:"{len(df)/seconds:.0f}site-days/s"'
+    logger.info(text)
+
 
 def ymd2date(ymd):
     return datetime.strptime(ymd, '%Y-%m-%d').date()
-        
 
-def parse_arguments():
+def ym2date(ym):
+    return datetime.strptime(ym, '%Y-%m').date()
+
+def y2date(y):
+    return datetime.strptime(y, '%Y').date()
+
+def hm2minute(hm):
+    hm = datetime.strptime(hm, '%H:%M')
+    return hm.hour*60 + hm.minute
+
+
+def get_forecast_days(args):
+    """ The days to forecast from the day, the range, the month or the year """
+    if args.year is not None:
+        start = args.year
+        end = start.replace(month = 12, day = 31)
+    elif args.month is not None:
+        start = args.month
+        end = (pd.Timestamp(start) + pd.offsets.MonthEnd(0)).date()
+    else:
+        start = args.forecast_day
+        end = start if args.last_day is None else args.last_day
+    return [stamp.date() for stamp in pd.date_range(start, end, freq = 'D')]
+
+
+SITE_KEYS = ('lat', 'lon', 'panel_name', 'system_barrier', 'inverter_limit',
+             'battery_split', 'battery_full', 'battery_first', 'horizon')
+ARRAY_KEYS = ('name', 'direction', 'slope', 'area', 'efficiency', 'bifacial', 'albedo', 'shading')
+# The keys with numbers and the site keys which may be None as their arguments
+SITE_NUMBERS = ('lat', 'lon', 'system_barrier', 'inverter_limit', 'battery_split', 'battery_full')
+SITE_NONES = ('inverter_limit', 'battery_split', 'battery_full')
+ARRAY_NUMBERS = ('direction', 'slope', 'area', 'efficiency', 'bifacial', 'albedo')
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def load_site(full_load_name):
+    """ The site configuration from a JSON, TOML or YAML file """
+    ext = os.path.splitext(full_load_name)[1].lower()
+    if ext == '.json':
+        with open(full_load_name) as f:
+            return json.load(f)
+    if ext == '.toml':
+        try:
+            import tomllib
+        except ImportError:
+            import tomli as tomllib
+        with open(full_load_name, 'rb') as f:
+            return tomllib.load(f)
+    if ext in ('.yaml', '.yml'):
+        import yaml
+        with open(full_load_name) as f:
+            return yaml.safe_load(f)
+    raise ValueError(f'Unknown format of the site file "{ext}"')
+
+
+def apply_site(args, site):
+    """ Overrides the arguments with the site. The arrays of the site
+    default to the panel arguments """
+    if not isinstance(site, dict):
+        raise ValueError('The site is no table')
+    for key, value in site.items():
+        if key == 'arrays':
+            if not isinstance(value, list) or len(value) == 0:
+                raise ValueError('The site arrays are no list of arrays')
+            for array in value:
+                if not isinstance(array, dict):
+                    raise ValueError(f'The site array is no table "{array}"')
+                unknown = set(array) - set(ARRAY_KEYS)
+                if unknown:
+                    raise ValueError(f'Unknown keys in site array "{", ".join(sorted(unknown))}"')
+                for number in ARRAY_NUMBERS:
+                    if number in array and not is_number(array[number]):
+                        raise ValueError(f'The site array "{number}" is no number "{array[number]}"')
+            args.arrays = value
+        elif key in SITE_KEYS:
+            if key in SITE_NUMBERS and not is_number(value) and not (value is None and key in SITE_NONES):
+                raise ValueError(f'The site "{key}" is no number "{value}"')
+            setattr(args, key, value)
+        else:
+            raise ValueError(f'Unknown key in site "{key}"')
+
+
+def get_arrays(args):
+    """ The panel arrays of the site or the single panel of the arguments """
+    panel = {'name': args.panel_name,
+             'direction': args.panel_direction,
+             'slope': args.panel_slope,
+             'area': args.panel_area,
+             'efficiency': args.panel_efficiency,
+             'bifacial': args.panel_bifacial,
+             'albedo': args.panel_albedo,
+             'shading': None}
+    if getattr(args, 'arrays', None) is None:
+        return [panel]
+    return [{**panel, 'name': f'Array {i+1}', **array} for i, array in enumerate(args.arrays)]
+
+
+def get_array_values(args, key, scale = 1):
+    """ The values of all arrays for the key. A scalar for a single panel """
+    values = [array[key] / scale for array in get_arrays(args)]
+    return values[0] if len(values) == 1 else values
+
+
+def get_horizon_table(args):
+    """ The compiled horizon of the site and the shading of the arrays,
+    None without """
+    shadings = tuple(get_profile_key(array['shading']) for array in get_arrays(args))
+    if args.horizon is None and all(shading is None for shading in shadings):
+        return None
+    return compile_horizon(get_profile_key(args.horizon), shadings)
+
+
+def get_ensemble_scenarios(args):
+    """ The scenarios of the ensemble of the arguments, None without """
+    if args.ensemble is None:
+        return None
+    return get_scenarios(args.ensemble, args.ensemble_efficiency/100, args.ensemble_albedo/100,
+                         args.ensemble_cloud/100, args.ensemble_seed)
+
+
+def get_panel_power(args, day, cache = None, weather = None):
+    """ The forecast for the panel in the arguments on one day. The
+    weather of the day is loaded if not given """
+    if _profiler is None and args.profile is not None:
+        # Worker processes started without the profiler of the parent
+        set_profiler(Stage_Profiler(args.profile))
+    if cache is None and args.cache is not None:
+        cache = Sun_Cache(args.cache, args.cache_size*2**20)
+    if weather is None and args.weather is not None:
+        weather = load_weather(args.weather, [day])[0]
+    return Panel_Power(args.lat, 
+                       args.lon, 
+                       args.panel_name, 
+                       get_array_values(args, 'direction'), 
+                       get_array_values(args, 'slope'), 
+                       get_array_values(args, 'area'),
+                       get_array_values(args, 'efficiency', 100),
+                       get_array_values(args, 'bifacial', 100),
+                       get_array_values(args, 'albedo', 100),
+                       args.system_barrier,
+                       args.inverter_limit,
+                       args.battery_split,
+                       args.battery_full,
+                       args.battery_first,
+                       day,
+                       args.engine,
+                       cache,
+                       [array['name'] for array in get_arrays(args)],
+                       args.resolution,
+                       weather,
+                       get_horizon_table(args),
+                       get_ensemble_scenarios(args))
+
+
+def get_panel_powers(args, days, weathers = None):
+    """ The forecasts for all days in order, with several jobs in a process
+    pool. The weather of all days is loaded at once if not given """
+    if weathers is None and args.weather is not None:
+        weathers = load_weather(args.weather, days)
+    weathers = [None]*len(days) if weathers is None else list(weathers)
+    jobs = os.cpu_count() if args.jobs == 0 else args.jobs
+    if jobs == 1 or len(days) == 1:
+        return [get_panel_power(args, day, None, weather) for day, weather in zip(days, weathers)]
+
+    chunksize = max(1, len(days) // (4*jobs))
+    with ProcessPoolExecutor(max_workers = jobs) as executor:
+        return list(executor.map(get_panel_power, repeat(args), days, repeat(None), weathers,
+                                 chunksize = chunksize))
+
+
+def iter_day_weathers(args, days, batch = 366):
+    """ The days with their weather, loaded for a batch of days at once """
+    for first in range(0, len(days), batch):
+        batch_days = days[first:first + batch]
+        if args.weather is None:
+            yield from zip(batch_days, repeat(None))
+        else:
+            yield from zip(batch_days, load_weather(args.weather, batch_days))
+
+
+def iter_panel_powers(args, days):
+    """ The forecasts of the days in order, one at a time. With several
+    jobs a bounded window of days is computed ahead in a process pool """
+    jobs = os.cpu_count() if args.jobs == 0 else args.jobs
+    if jobs == 1 or len(days) == 1:
+        for day, weather in iter_day_weathers(args, days):
+            yield get_panel_power(args, day, None, weather)
+        return
+
+    with ProcessPoolExecutor(max_workers = jobs) as executor:
+        pending = deque()
+        for day, weather in iter_day_weathers(args, days):
+            pending.append(executor.submit(get_panel_power, args, day, None, weather))
+            if len(pending) > 4*jobs:
+                yield pending.popleft().result()
+        while len(pending) > 0:
+            yield pending.popleft().result()
+
+
+def get_api_arguments(arguments):
+    """ The checked arguments for the keywords named like the command line
+    options. Raises ValueError for unknown or invalid arguments """
+    unknown = set(arguments) - set(vars(parse_arguments([])))
+    if unknown:
+        raise ValueError(f'Unknown arguments "{", ".join(sorted(unknown))}"')
+    try:
+        args = parse_arguments(request2argv(arguments))
+    except SystemExit:
+        raise ValueError(f'Invalid arguments "{arguments}"')
+    errcode = check_arguments(args)
+    if errcode > 0:
+        raise ValueError(f'Arguments out of range, error {errcode}')
+    return args
+
+
+def forecast(day = None, **arguments):
+    """ The forecast of the day as Panel_Power for the keywords named like
+    the command line options, e.g.
+    forecast('2024-06-21', panel_slope = 30).data['tot_w'] """
+    args = get_api_arguments({**arguments, 'forecast_day': day})
+    return get_panel_power(args, args.forecast_day)
+
+
+def forecasts(**arguments):
+    """ The forecasts of all days of the keywords as list of Panel_Power,
+    e.g. forecasts(month = '2024-06', jobs = 0) """
+    args = get_api_arguments(arguments)
+    return get_panel_powers(args, get_forecast_days(args))
+
+
+def rolling(day = None, minutes = None, **arguments):
+    """ The generator of the updates of the remaining day for the keywords
+    named like the command line options. Observations are sent into it, e.g.
+    updates = rolling('2024-06-21', battery_full = 500); next(updates)
+    updates.send({'bat_wh': 120}) """
+    args = get_api_arguments({**arguments, 'forecast_day': day})
+    return iter_rolling(get_panel_power(args, args.forecast_day), minutes)
+
+
+def parse_arguments(argv = None):
     """Parse command line arguments"""
 
     parser = argparse.ArgumentParser(
@@ -382,25 +2435,187 @@ def parse_arguments():
 
     parser.add_argument('--battery_first', action = 'store_true', dest='battery_first',
                         help = 'Serve the battery first! Serve the house second!')
+
+    parser.add_argument('--load', default = None,
+                        help = 'The house load as constant [W] or CSV file. Dispatches the battery over all days')
+
+    parser.add_argument('--battery_charge', type = float, default = None,
+                        help = 'The maximum charge power of the battery with a house load [W]')
+
+    parser.add_argument('--battery_discharge', type = float, default = None,
+                        help = 'The maximum discharge power of the battery with a house load [W]')
+
+    parser.add_argument('--battery_start', type = float, default = 0.0,
+                        help = 'The energy in the battery at the start of the first day with a house load [Wh]')
     
+    parser.add_argument('--weather', default = None,
+                        help = 'The CSV or Parquet file of the weather with a factor or cloud cover [%%] for timestamps')
+
+    parser.add_argument('--horizon', default = None,
+                        help = 'The CSV file or JSON list of the azimuth and altitude pairs of the horizon')
+
+    parser.add_argument('--ensemble', type = int, default = None,
+                        help = 'The number of scenarios of an ensemble with P10, P50 and P90 bands')
+
+    parser.add_argument('--ensemble_efficiency', type = float, default = 10.0,
+                        help = 'The relative deviation of the efficiency of the scenarios [%%]')
+
+    parser.add_argument('--ensemble_albedo', type = float, default = 5.0,
+                        help = 'The deviation of the albedo of the scenarios [%%]')
+
+    parser.add_argument('--ensemble_cloud', type = float, default = 50.0,
+                        help = 'The highest cloud cover of the scenarios [%%]')
+
+    parser.add_argument('--ensemble_seed', type = int, default = 0,
+                        help = 'The seed of the random scenarios')
+
+    parser.add_argument('--site', default = None,
+                        help = 'The JSON, TOML or YAML file of a site with several panel arrays')
+
+    parser.add_argument('--fleet', default = None,
+                        help = 'The CSV or Parquet table of sites with a row each to forecast at once')
+
+    parser.add_argument('--fleet_chunk', type = int, default = 256,
+                        help = 'The number of fleet sites computed at once, bounds the memory')
+
+    parser.add_argument('--engine', choices = SUN_ENGINES, default = 'numpy',
+                        help = 'The engine for the sun track. pysolar is the slow reference')
+
+    parser.add_argument('--resolution', type = int, default = 1,
+                        help = 'The minutes between evaluations of the sun track above 10°, interpolated in between [1 - 15]')
+
+    parser.add_argument('--cache', default = os.environ.get('SOLAR_PROPHET_CACHE_DIR'),
+                        help = 'The directory for caching the sun tracks. Defaults to SOLAR_PROPHET_CACHE_DIR')
+
+    parser.add_argument('--cache_size', type = float, default = 64.0,
+                        help = 'The maximum size of the sun track cache [MB]')
+
+    parser.add_argument('--cache_clear', action = 'store_true', dest='cache_clear',
+                        help = 'Invalidate all sun tracks in the cache before the forecast')
+
     parser.add_argument('--csv', default = None,
                         help = 'The directory for saving of the CSV file if needed')
 
+    parser.add_argument('--data_format', choices = DATA_FORMATS, default = 'csv',
+                        help = 'The format of the minutes saved with --csv and --dataset')
+
+    parser.add_argument('--float32', action = 'store_true', dest='float32',
+                        help = 'Save the minutes and compute the fleet with single precision')
+
+    parser.add_argument('--aggregate', action = 'store_true', dest='aggregate',
+                        help = 'Stream the days into totals of days, months and years without the minutes')
+
+    parser.add_argument('--rolling', action = 'store_true', dest='rolling',
+                        help = 'Stream the remaining day each minute as JSON lines, observations from stdin')
+
+    parser.add_argument('--rolling_start', type = hm2minute, default = None,
+                        help = 'The first minute of the rolling forecast as HH:MM. Now for today, the sunrise else')
+
+    parser.add_argument('--dataset', default = None,
+                        help = 'The directory of a dataset to append the minutes of all days and panels')
+
+    parser.add_argument('--data_benchmark', action = 'store_true', dest='data_benchmark',
+                        help = 'Log the times to write and read the minutes in all formats')
+
     parser.add_argument('--plot', default = None,
                         help = 'The directory for saving of the PNG file if needed')
+
+    parser.add_argument('--plot_format', choices = PLOT_FORMATS, default = 'png',
+                        help = 'A PNG file for each day or one PDF file with a page for each day')
+
+    parser.add_argument('--plot_dpi', type = float, default = 100.0,
+                        help = 'The resolution of the plots. Thumbnails with a low value')
     
+    parser.add_argument('--optimize', action = 'store_true', dest='optimize',
+                        help = 'Search the panel direction and slope with the best harvest in the days')
+
+    parser.add_argument('--optimize_step', type = float, default = 5.0,
+                        help = 'The step of the attitude grid of the search [deg]')
+
+    parser.add_argument('--optimize_refine', action = 'store_true', dest='optimize_refine',
+                        help = 'Refine the best attitude of the grid with a local search')
+
+    parser.add_argument('--calibrate', default = None,
+                        help = 'The CSV file of measured daily energies [Wh] or minute powers [W] to calibrate the efficiency')
+
+    parser.add_argument('--calibrate_by', choices = CALIBRATE_GROUPS, default = 'all',
+                        help = 'Calibrate the efficiency for each day, each season or all days')
+
+    parser.add_argument('--calibrate_bifacial', action = 'store_true', dest='calibrate_bifacial',
+                        help = 'Calibrate the bifacial factor together with the efficiency')
+
+    parser.add_argument('--calibrate_albedo', action = 'store_true', dest='calibrate_albedo',
+                        help = 'Calibrate the albedo factor together with the efficiency')
+
+    parser.add_argument('--serve', action = 'store_true', dest='serve',
+                        help = 'Serve forecasts for JSON lines with the arguments as keys')
+
+    parser.add_argument('--serve_port', type = int, default = 8642,
+                        help = 'The localhost port of the forecast server')
+
+    parser.add_argument('--serve_socket', default = None,
+                        help = 'The unix socket of the forecast server instead of the port')
+
+    parser.add_argument('--profile', nargs = '?', const = '-', default = None,
+                        help = 'Record the time of each stage as JSON lines to the file or to stderr')
+
+    parser.add_argument('--profile_stats', default = None,
+                        help = 'The file for saving the cProfile statistics of the run')
+
+    parser.add_argument('--jobs', type = int, default = 1,
+                        help = 'The number of processes to compute the days. All cores with 0')
+
+    parser.add_argument('--last_day', type = ymd2date, default = None,
+                        help = 'The last day of a forecast range starting with the forecast day [YYYY-MM-DD]')
+
+    parser.add_argument('--month', type = ym2date, default = None,
+                        help = 'Forecast all days of the month instead of the forecast day [YYYY-MM]')
+
+    parser.add_argument('--year', type = y2date, default = None,
+                        help = 'Forecast all days of the year instead of the forecast day [YYYY]')
+
     parser.add_argument('forecast_day',
                         type=ymd2date, default = datetime.now().strftime('%Y-%m-%d'), nargs = '?',
                         help = 'Day for forecast')
 
-    parser.set_defaults(battery_first = False)
+    parser.set_defaults(battery_first = False, cache_clear = False,
+                        optimize = False, optimize_refine = False,
+                        calibrate_bifacial = False, calibrate_albedo = False,
+                        serve = False, float32 = False, data_benchmark = False, aggregate = False)
 
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
 
-def main():
-    args = parse_arguments()
+def check_profile(profile):
+    """ True for no profile or azimuth and altitude pairs in range """
+    try:
+        pairs = np.array(profile if profile is not None else [], dtype = float).reshape(-1, 2)
+    except ValueError:
+        return False
+    return bool(np.all((pairs[:, 0] >= 0) & (pairs[:, 0] <= 360) &
+                       (pairs[:, 1] >= -90) & (pairs[:, 1] <= 90)))
+
+
+def check_arguments(args):
+    """ Applies the site and checks the arguments. Returns an error code """
+    if args.site is not None:
+        try:
+            apply_site(args, load_site(args.site))
+        except (OSError, ValueError, ImportError) as e:
+            logger.error(f'The site cannot be loaded "{args.site}": {e}')
+            return 18
         
+    if isinstance(args.horizon, str):
+        try:
+            args.horizon = load_horizon(args.horizon)
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f'The horizon cannot be loaded "{args.horizon}": {e}')
+            return 35
+
+    if not check_profile(args.horizon):
+        logger.error(f'The horizon is out of range  "{args.horizon}"')
+        return 36
+
     if args.lat < -90 or args.lat > 90:
         logger.error(f'The latitude of the panel position is out of range  "{args.lat}"')
         return 1
@@ -409,25 +2624,30 @@ def main():
         logger.error(f'The longitude of the panel position is out of range  "{args.lon}"')
         return 2
 
-    if args.panel_direction < 0 or args.panel_direction > 360:
-        logger.error(f'The direction of the panel is out of range  "{args.panel_direction}"')
-        return 3
+    for array in get_arrays(args):
+        if array['direction'] < 0 or array['direction'] > 360:
+            logger.error(f'The direction of the panel is out of range  "{array["direction"]}"')
+            return 3
+
+        if array['slope'] < 0 or array['slope'] > 360:
+            logger.error(f'The slope of the panel is out of range  "{array["slope"]}"')
+            return 4
 
-    if args.panel_slope < 0 or args.panel_slope > 360:
-        logger.error(f'The slope of the panel is out of range  "{args.panel_slope}"')
-        return 4
+        if array['efficiency'] < 0 or array['efficiency'] > 100:
+            logger.error(f'The efficiency of the panel is out of range  "{array["efficiency"]}"')
+            return 5
 
-    if args.panel_efficiency < 0 or args.panel_efficiency > 100:
-        logger.error(f'The efficiency of the panel is out of range  "{args.panel_efficiency}"')
-        return 5
+        if array['bifacial'] < 0 or array['bifacial'] > 60:
+            logger.error(f'The bifacial factor of the panel is out of range  "{array["bifacial"]}"')
+            return 6
 
-    if args.panel_bifacial < 0 or args.panel_bifacial > 60:
-        logger.error(f'The bifacial factor of the panel is out of range  "{args.panel_bifacial}"')
-        return 6
+        if array['albedo'] < 0 or array['albedo'] > 30:
+            logger.error(f'The albedo of the panel is out of range  "{array["albedo"]}"')
+            return 7
 
-    if args.panel_albedo < 0 or args.panel_albedo > 30:
-        logger.error(f'The albedo of the panel is out of range  "{args.panel_albedo}"')
-        return 7
+        if not check_profile(array['shading']):
+            logger.error(f'The shading of the panel is out of range  "{array["shading"]}"')
+            return 36
     
     if args.system_barrier < 0:
         logger.error(f'The system barrier is out of range  "{args.system_barrier}"')
@@ -448,63 +2668,668 @@ def main():
     if args.battery_first and args.battery_split is None and args.battery_full is None:
         logger.error(f'The combination of battery parameters is illegal.')
         return 12
+
+    if args.battery_charge is not None and args.battery_charge < 0:
+        logger.error(f'The charge power is out of range  "{args.battery_charge}"')
+        return 24
+
+    if args.battery_discharge is not None and args.battery_discharge < 0:
+        logger.error(f'The discharge power is out of range  "{args.battery_discharge}"')
+        return 25
+
+    if args.battery_start < 0 or args.battery_start > (args.battery_full or 0):
+        if args.battery_start != 0:
+            logger.error(f'The start energy is out of range  "{args.battery_start}"')
+            return 26
         
     if not args.csv is None and not os.path.isdir(args.csv):
         logger.error(f'The directory to save the CSV does not exist "{args.csv}"')
         return 13
 
-    
-    logger.info(f'Estimating the harvest of "{args.panel_name}" on "{args.forecast_day}"' )
+    if args.last_day is not None and args.last_day < args.forecast_day:
+        logger.error(f'The last day is before the forecast day "{args.last_day}"')
+        return 14
 
-    text = f' Area: "{args.panel_area:.2f}m²"'
-    text += f', Lat/Lon:"{args.lat:.2f}/{args.lon:.2f}"'
-    text += f', Dir/Slope:"{args.panel_direction:.0f}/{args.panel_slope:.0f}"'
-    logger.info(text)
-    text = f' Efficiency: "{args.panel_efficiency:.0f}%"'
-    text += f', Start Barrier: "{args.system_barrier:.0f}W"'
+    if sum(arg is not None for arg in (args.last_day, args.month, args.year)) > 1:
+        logger.error(f'Only one of last day, month or year may be provided')
+        return 15
+
+    if args.jobs < 0:
+        logger.error(f'The number of jobs is out of range "{args.jobs}"')
+        return 16
+
+    if args.cache_size < 0:
+        logger.error(f'The cache size is out of range "{args.cache_size}"')
+        return 17
+
+    if args.cache is not None:
+        try:
+            Sun_Cache(args.cache)
+        except OSError as e:
+            logger.error(f'The cache directory cannot be created "{args.cache}": {e}')
+            return 40
+
+    if args.plot_dpi <= 0:
+        logger.error(f'The plot resolution is out of range "{args.plot_dpi}"')
+        return 29
+
+    if args.resolution < 1 or args.resolution > MAX_RESOLUTION:
+        logger.error(f'The resolution is out of range "{args.resolution}"')
+        return 30
+
+    if args.fleet is not None and not os.path.isfile(args.fleet):
+        logger.error(f'The fleet file does not exist "{args.fleet}"')
+        return 31
+
+    if args.fleet_chunk < 1:
+        logger.error(f'The fleet chunk is out of range "{args.fleet_chunk}"')
+        return 32
+
+    if args.weather is not None and not os.path.isfile(args.weather):
+        logger.error(f'The weather file does not exist "{args.weather}"')
+        return 33
+
+    if args.ensemble is not None and args.ensemble < 1:
+        logger.error(f'The number of scenarios is out of range "{args.ensemble}"')
+        return 37
+
+    if args.ensemble_efficiency < 0 or args.ensemble_albedo < 0 or \
+       args.ensemble_cloud < 0 or args.ensemble_cloud > 100:
+        logger.error(f'The deviations of the scenarios are out of range')
+        return 38
+
+    if args.optimize or args.calibrate is not None or args.fleet is not None:
+        if args.horizon is not None or any(array['shading'] is not None for array in get_arrays(args)):
+            logger.error(f'The horizon and the shading are not supported by optimize, calibrate and fleet')
+            return 41
+
+        if args.weather is not None:
+            logger.error(f'The weather is not supported by optimize, calibrate and fleet "{args.weather}"')
+            return 42
+
+    return 0
+
+
+def main():
+    warnings.simplefilter("ignore")
+    logging.basicConfig(level=logging.INFO)
+
+    args = parse_arguments()
+
+    errcode = check_arguments(args)
+    if errcode > 0:
+        return errcode
+
+    if args.serve:
+        return main_serve(args)
+
+    if args.profile is not None or args.profile_stats is not None:
+        return main_profile(args)
+
+    return main_forecast(args)
+
+
+def main_forecast(args):
+    """ Forecasts, calibrates or optimizes the days of the arguments """
+    arrays = get_arrays(args)
+
+    if args.cache is not None and args.cache_clear:
+        Sun_Cache(args.cache).clear()
+        logger.info(f'Cache cleared "{args.cache}"')
+
+    if args.calibrate is not None:
+        return main_calibrate(args)
+
+    days = get_forecast_days(args)
+
+    if args.fleet is not None:
+        return main_fleet(args, days)
+    
+    if len(days) == 1:
+        logger.info(f'Estimating the harvest of "{args.panel_name}" on "{days[0]}"' )
+    else:
+        logger.info(f'Estimating the harvest of "{args.panel_name}" from "{days[0]}" to "{days[-1]}"' )
+
+    for array in arrays:
+        text = f' Area: "{array["area"]:.2f}m²"'
+        text += f', Lat/Lon:"{args.lat:.2f}/{args.lon:.2f}"'
+        text += f', Dir/Slope:"{array["direction"]:.0f}/{array["slope"]:.0f}"'
+        if len(arrays) > 1:
+            text += f', Array:"{array["name"]}"'
+        logger.info(text)
+        if len(arrays) > 1:
+            text = f' Efficiency: "{array["efficiency"]:.0f}%"'
+            text += f', Bifacial: "{array["bifacial"]:.0f}%"'
+            text += f', Albedo: "{array["albedo"]:.0f}%"'
+            logger.info(text)
+    text = f' Efficiency: "{arrays[0]["efficiency"]:.0f}%", ' if len(arrays) == 1 else ' '
+    text += f'Start Barrier: "{args.system_barrier:.0f}W"'
     if args.inverter_limit is not None:
         text += f', Inverter Limit: "{args.inverter_limit:.0f}W"' 
     logger.info(text)
-    text = f' Bifacial: "{args.panel_bifacial:.0f}%"'
-    text += f', Albedo: "{args.panel_albedo:.0f}%"'
-    logger.info(text)
+    if len(arrays) == 1:
+        text = f' Bifacial: "{arrays[0]["bifacial"]:.0f}%"'
+        text += f', Albedo: "{arrays[0]["albedo"]:.0f}%"'
+        logger.info(text)
 
-    pp = Panel_Power(args.lat, 
-                     args.lon, 
-                     args.panel_name, 
-                     args.panel_direction, 
-                     args.panel_slope, 
-                     args.panel_area,
-                     args.panel_efficiency / 100,
-                     args.panel_bifacial / 100,
-                     args.panel_albedo / 100,
-                     args.system_barrier,
-                     args.inverter_limit,
-                     args.battery_split,
-                     args.battery_full,
-                     args.battery_first,
-                     args.forecast_day)
-
-    errcode = pp.summarize()
-    if errcode > 0:
+    if args.optimize:
+        return main_optimize(args, days)
+
+    if args.aggregate:
+        return main_aggregate(args, days)
+
+    if args.rolling:
+        return main_rolling(args, days)
+
+    weathers = None
+    if args.weather is not None:
+        try:
+            weathers = load_weather(args.weather, days)
+        except (OSError, ValueError, KeyError, ImportError) as e:
+            logger.error(f'The weather cannot be loaded "{args.weather}": {e}')
+            return 33
+        summarize_weather(weathers)
+
+    pps = get_panel_powers(args, days, weathers)
+
+    errcodes = [pp.summarize() for pp in pps]
+    if all(errcode > 0 for errcode in errcodes):
         logger.error(f'The combination of the provided parameters does not qualify for harvesting')
         return 12
 
-    if not args.csv is None:            
-        save_name = args.panel_name.replace(' ', '_') + args.forecast_day.strftime("_%y%m%d") + '.csv'
-        pp.save_csv(os.path.join(args.csv, save_name))
-        logger.info(f'CSV saved to  "{os.path.join(args.csv, save_name)}"' )
+    if len(days) > 1:
+        summarize_days(pps)
+
+    if args.cache is not None:
+        hits = sum(pp.cached for pp in pps)
+        logger.info(f'Cache # Hits:"{hits}", Misses:"{len(pps) - hits}"')
+
+    if args.load is not None:
+        try:
+            dispatch_df = get_load_dispatch_df(pps, args.load, args.inverter_limit, args.battery_full,
+                                               args.battery_charge, args.battery_discharge,
+                                               args.battery_start)
+        except (OSError, ValueError, IndexError) as e:
+            logger.error(f'The house load cannot be loaded "{args.load}": {e}')
+            return 27
+        summarize_load_dispatch(dispatch_df)
+
+    save_base = args.panel_name.replace(' ', '_') + days[0].strftime("_%y%m%d")
+    if len(days) > 1:
+        save_base += days[-1].strftime("_%y%m%d")
+
+    try:
+        if not args.csv is None:            
+            save_name = save_base + '.' + args.data_format
+            save_data(pd.concat([pp.df for pp in pps]), os.path.join(args.csv, save_name),
+                      args.data_format, args.float32)
+            logger.info(f'{args.data_format.upper()} saved to  "{os.path.join(args.csv, save_name)}"' )
+
+        if not args.csv is None and args.load is not None:
+            save_name = save_base + '_dispatch.' + args.data_format
+            save_data(dispatch_df, os.path.join(args.csv, save_name),
+                      args.data_format, args.float32)
+            logger.info(f'{args.data_format.upper()} saved to  "{os.path.join(args.csv, save_name)}"' )
+
+        if not args.dataset is None:
+            append_dataset(pd.concat([pp.df for pp in pps]), args.dataset,
+                           args.panel_name, args.data_format, args.float32)
+            logger.info(f'DATASET appended to  "{args.dataset}"' )
+    except ImportError as e:
+        logger.error(f'The data format is not available "{args.data_format}": {e}')
+        return 28
+
+    if args.data_benchmark:
+        with tempfile.TemporaryDirectory() as directory:
+            benchmark_data(pd.concat([pp.df for pp in pps]), directory)
         
     if not args.plot is None:
-        save_name = args.panel_name.replace(' ', '_') + args.forecast_day.strftime("_%y%m%d") + '.png'
-        pp.save_plot(args.lat, args.lon, args.panel_direction,
-                     args.panel_slope, args.panel_area,
-                     os.path.join(args.plot, save_name))
-        logger.info(f'PLOT saved to  "{os.path.join(args.plot, save_name)}"' )
+        plot_pps = [pp for pp, errcode in zip(pps, errcodes) if errcode == 0]
+        plot_args = (args.lat, args.lon, get_array_values(args, 'direction'),
+                     get_array_values(args, 'slope'), get_array_values(args, 'area'))
+        if args.plot_format == 'pdf':
+            save_name = save_base + '.pdf'
+            render_plots_pdf(plot_pps, *plot_args, os.path.join(args.plot, save_name), args.plot_dpi)
+            logger.info(f'PLOT saved to  "{os.path.join(args.plot, save_name)}"' )
+        else:
+            full_save_names = [os.path.join(args.plot, args.panel_name.replace(' ', '_') +
+                                            pp.day.strftime("_%y%m%d") + '.png')
+                               for pp in plot_pps]
+            jobs = os.cpu_count() if args.jobs == 0 else args.jobs
+            for full_save_name in save_plots(plot_pps, *plot_args, full_save_names,
+                                             args.plot_dpi, jobs):
+                logger.info(f'PLOT saved to  "{full_save_name}"' )
         
     return 0
 
 
+def main_aggregate(args, days):
+    """ Streams the days into the totals of the days, months, years and
+    all days without keeping the minutes """
+    save_base = args.panel_name.replace(' ', '_') + days[0].strftime("_%y%m%d")
+    if len(days) > 1:
+        save_base += days[-1].strftime("_%y%m%d")
+
+    files, writers = [], {}
+    dataset = None if args.dataset is None else (args.dataset, args.panel_name,
+                                                 args.data_format, args.float32)
+    try:
+        if args.csv is not None:
+            for level in AGGREGATE_LEVELS:
+                files.append(open(os.path.join(args.csv, f'{save_base}_{level}.csv'), 'w', newline = ''))
+                writers[level] = None, files[-1]
+
+        totals = iter_totals(iter_panel_powers(args, days), dataset)
+        for level, row in aggregate_yields(totals):
+            if level in writers:
+                writer, file = writers[level]
+                if writer is None:
+                    writer = csv.DictWriter(file, fieldnames = list(row))
+                    writer.writeheader()
+                    writers[level] = writer, file
+                writer.writerow(row)
+            if level in ('year', 'all'):
+                log_yield(level, row)
+    except (OSError, ValueError, KeyError) as e:
+        logger.error(f'The days cannot be aggregated: {e}')
+        return 34
+    except ImportError as e:
+        logger.error(f'The data format is not available "{args.data_format}": {e}')
+        return 28
+    finally:
+        for file in files:
+            file.close()
+
+    for file in files:
+        logger.info(f'CSV saved to  "{file.name}"' )
+
+    if row['no_harvest_days'] == row['days']:
+        logger.error(f'The combination of the provided parameters does not qualify for harvesting')
+        return 12
+
+    return 0
+
+
+def main_rolling(args, days):
+    """ Streams the updates of the remaining day as JSON lines to stdout.
+    Today is streamed live each minute, other days are replayed. The
+    observations are read as JSON lines from stdin if it is no terminal """
+    if len(days) > 1:
+        logger.error(f'The rolling forecast needs a single day')
+        return 39
+
+    pp = get_panel_power(args, days[0])
+    midnight = get_day_stamps(pp.day, pp.tzinfo)[0]
+    now = datetime.now(pp.tzinfo)
+    live = now.date() == pp.day
+    if args.rolling_start is not None:
+        start = args.rolling_start
+    elif live:
+        start = now.hour*60 + now.minute
+    else:
+        start = int(pp.minutes[0]) if len(pp.minutes) > 0 else 0
+    end = max(int(pp.minutes[-1]) if len(pp.minutes) > 0 else 0, start)
+
+    observations, pending = queue.Queue(), []
+    if not sys.stdin.isatty():
+        reader = threading.Thread(target = read_observations, daemon = True,
+                                  args = (sys.stdin, observations, pp.tzinfo))
+        reader.start()
+        if not live:
+            reader.join()
+
+    updates = iter_rolling(pp, range(start, end + 1))
+    update = next(updates)
+    for minute in range(start, end + 1):
+        try:
+            print(json.dumps(update), flush = True)
+        except BrokenPipeError:
+            # The reader of stdout has gone, silence the flush at the exit
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            return 0
+        if live:
+            wait = midnight + timedelta(minutes = minute + 1) - datetime.now(pp.tzinfo)
+            time.sleep(max(wait.total_seconds(), 0.0))
+
+        while not observations.empty():
+            pending.append(observations.get())
+        pending.sort(key = lambda item: -1 if item[0] is None else item[0])
+        observation = {}
+        while len(pending) > 0 and (pending[0][0] is None or pending[0][0] <= minute):
+            observation.update(pending.pop(0)[1])
+        try:
+            update = updates.send(observation or None)
+        except StopIteration:
+            break
+    return 0
+
+
+def main_fleet(args, days):
+    """ Forecasts the days for all sites of the fleet table """
+    try:
+        sites = load_fleet(args.fleet, args)
+    except (OSError, ValueError, ImportError) as e:
+        logger.error(f'The fleet cannot be loaded "{args.fleet}": {e}')
+        return 31
+
+    if len(days) == 1:
+        logger.info(f'Estimating the harvest of "{len(sites["lat"])}" sites on "{days[0]}"' )
+    else:
+        logger.info(f'Estimating the harvest of "{len(sites["lat"])}" sites from "{days[0]}" to "{days[-1]}"' )
+
+    jobs = os.cpu_count() if args.jobs == 0 else args.jobs
+    begin = time.perf_counter()
+    df = get_fleet_days(sites, days, args.fleet_chunk, args.float32, jobs)
+    summarize_fleet(df, time.perf_counter() - begin)
+
+    if not args.csv is None:
+        save_name = os.path.splitext(os.path.basename(args.fleet))[0] + days[0].strftime("_%y%m%d")
+        if len(days) > 1:
+            save_name += days[-1].strftime("_%y%m%d")
+        save_name += '_fleet.' + args.data_format
+        try:
+            save_data(df, os.path.join(args.csv, save_name), args.data_format, args.float32)
+        except ImportError as e:
+            logger.error(f'The data format is not available "{args.data_format}": {e}')
+            return 28
+        logger.info(f'{args.data_format.upper()} saved to  "{os.path.join(args.csv, save_name)}"' )
+
+    return 0
+
+
+def main_profile(args):
+    """ Forecasts with the stages recorded as JSON lines and a summary
+    logged for each stage. cProfile statistics are saved if requested """
+    profiler = Stage_Profiler(args.profile)
+    previous = set_profiler(profiler)
+    cprofile = cProfile.Profile() if args.profile_stats is not None else None
+    try:
+        if cprofile is not None:
+            cprofile.enable()
+        with profiler.stage('main'):
+            errcode = main_forecast(args)
+    finally:
+        if cprofile is not None:
+            cprofile.disable()
+        set_profiler(previous)
+        profiler.close()
+
+    for stage, totals in profiler.get_summary().items():
+        text = f'Profile # "{stage}",'
+        text += f' Calls:"{totals["calls"]}",'
+        text += f' Wall:"{totals["wall"]:.3f}s",'
+        text += f' CPU:"{totals["cpu"]:.3f}s",'
+        text += f' Net blocks:"{totals["net_blocks"]}"'
+        logger.info(text)
+
+    if cprofile is not None:
+        cprofile.dump_stats(args.profile_stats)
+        logger.info(f'PROFILE saved to  "{args.profile_stats}"' )
+
+    return errcode
+
+
+def main_optimize(args, days):
+    """ Searches the attitude of the panel with the best harvest """
+    if len(get_arrays(args)) > 1:
+        logger.error(f'The attitude can only be optimized for a single panel')
+        return 19
+
+    if args.optimize_step <= 0 or args.optimize_step > 45:
+        logger.error(f'The step of the attitude grid is out of range "{args.optimize_step}"')
+        return 20
+
+    cache = None if args.cache is None else Sun_Cache(args.cache, args.cache_size*2**20)
+    tracks = [get_sun_minutes(args.lat, args.lon, get_day_stamps(day), args.engine, cache, args.resolution)
+              for day in days]
+
+    directions, slopes, harvests, best_direction, best_slope, best_harvest = \
+        optimize_attitude(tracks, args.panel_area, args.panel_efficiency / 100,
+                          args.panel_bifacial / 100, args.panel_albedo / 100,
+                          args.system_barrier, args.optimize_step, args.optimize_refine)
+
+    text = f'Attitude # Best:"{best_direction:.1f}/{best_slope:.1f}",'
+    text += f' Total:"{best_harvest/1000:.2f}kWh"'
+    logger.info(text)
+
+    panel_harvest = get_attitude_harvests(tracks, args.panel_direction, args.panel_slope,
+                                          args.panel_area, args.panel_efficiency / 100,
+                                          args.panel_bifacial / 100, args.panel_albedo / 100,
+                                          args.system_barrier)
+    text = f'Attitude # Panel:"{args.panel_direction:.1f}/{args.panel_slope:.1f}",'
+    text += f' Total:"{panel_harvest/1000:.2f}kWh",'
+    text += f' "{100*panel_harvest/best_harvest:.0f}%"'
+    logger.info(text)
+
+    save_base = args.panel_name.replace(' ', '_') + days[0].strftime("_%y%m%d")
+    if len(days) > 1:
+        save_base += days[-1].strftime("_%y%m%d")
+    save_base += '_attitude'
+
+    if not args.csv is None:
+        save_name = save_base + '.csv'
+        df = pd.DataFrame(harvests, index = pd.Index(directions, name = 'direction'),
+                          columns = pd.Index(slopes, name = 'slope'))
+        df.to_csv(os.path.join(args.csv, save_name))
+        logger.info(f'CSV saved to  "{os.path.join(args.csv, save_name)}"' )
+
+    if not args.plot is None:
+        save_name = save_base + '.png'
+        save_attitude_plot(args.panel_name, days, directions, slopes, harvests,
+                           best_direction, best_slope, best_harvest,
+                           os.path.join(args.plot, save_name))
+        logger.info(f'PLOT saved to  "{os.path.join(args.plot, save_name)}"' )
+
+    return 0
+
+
+def main_calibrate(args):
+    """ Calibrates the efficiency of the panel with the measured harvest """
+    if len(get_arrays(args)) > 1:
+        logger.error(f'The efficiency can only be calibrated for a single panel')
+        return 21
+
+    tzinfo = datetime.now().astimezone().tzinfo
+    try:
+        measured, is_daily = load_measured(args.calibrate, tzinfo)
+    except (OSError, ValueError, IndexError) as e:
+        logger.error(f'The measured harvest cannot be loaded "{args.calibrate}": {e}')
+        return 22
+
+    days = sorted(set(stamp.date() for stamp in measured.index))
+    if len(days) == 0:
+        logger.error(f'The measured harvest is empty "{args.calibrate}"')
+        return 22
+
+    logger.info(f'Calibrating the efficiency of "{args.panel_name}" with {len(days)} days of "{args.calibrate}"')
+
+    cache = None if args.cache is None else Sun_Cache(args.cache, args.cache_size*2**20)
+    stamps = [get_day_stamps(day) for day in days]
+    tracks = [get_sun_minutes(args.lat, args.lon, day_stamps, args.engine, cache, args.resolution)
+              for day_stamps in stamps]
+
+    if is_daily:
+        measures = [measured[measured.index.date == day].iloc[0] for day in days]
+    else:
+        measures = [measured[measured.index.date == day] for day in days]
+
+    if args.calibrate_by == 'day':
+        labels = [day.strftime('%Y-%m-%d') for day in days]
+    elif args.calibrate_by == 'season':
+        labels = [SEASONS[day.month - 1] for day in days]
+    else:
+        labels = ['all'] * len(days)
+
+    bifacials = np.arange(0.0, 0.6 + 0.05, 0.1) \
+        if args.calibrate_bifacial else [args.panel_bifacial / 100]
+    albedos = np.arange(0.0, 0.3 + 0.05, 0.1) \
+        if args.calibrate_albedo else [args.panel_albedo / 100]
+
+    results = calibrate_efficiency(tracks, stamps, measures, labels, is_daily, bifacials, albedos,
+                                   args.panel_direction, args.panel_slope, args.panel_area,
+                                   args.system_barrier, args.inverter_limit, args.battery_split,
+                                   args.battery_full, args.battery_first)
+
+    rows = []
+    for label, (efficiency, bifacial, albedo, model_wh, error) in results.items():
+        measured_wh = sum(measure if is_daily else measure.sum()/60
+                          for measure, day_label in zip(measures, labels) if day_label == label)
+        text = f'Calibration # "{label}",'
+        text += f' Efficiency:"{100*efficiency:.1f}%",'
+        if args.calibrate_bifacial:
+            text += f' Bifacial:"{100*bifacial:.0f}%",'
+        if args.calibrate_albedo:
+            text += f' Albedo:"{100*albedo:.0f}%",'
+        text += f' Measured:"{measured_wh:.0f}Wh",'
+        text += f' Model:"{model_wh:.0f}Wh"'
+        logger.info(text)
+        rows.append({'group': label, 'efficiency': 100*efficiency, 'bifacial': 100*bifacial,
+                     'albedo': 100*albedo, 'measured_wh': measured_wh, 'model_wh': model_wh})
+
+    if not args.csv is None:
+        save_name = args.panel_name.replace(' ', '_') + days[0].strftime("_%y%m%d")
+        save_name += days[-1].strftime("_%y%m%d") + '_calibration.csv'
+        pd.DataFrame(rows).set_index('group').to_csv(os.path.join(args.csv, save_name))
+        logger.info(f'CSV saved to  "{os.path.join(args.csv, save_name)}"' )
+
+    return 0
+
+
+def request2argv(request):
+    """ The command line for the keys and values of a request """
+    argv = []
+    for key, value in request.items():
+        if key == 'forecast_day':
+            continue
+        if value is True:
+            argv.append(f'--{key}')
+        elif isinstance(value, (list, tuple)):
+            argv.extend([f'--{key}', json.dumps(value)])
+        elif value is not None and value is not False:
+            argv.extend([f'--{key}', str(value)])
+    if request.get('forecast_day') is not None:
+        argv.append(str(request['forecast_day']))
+    return argv
+
+
+class Forecast_Server(object):
+    """ Serves forecasts with the libraries loaded and the sun tracks
+    cached in memory. Each request is a JSON line with the arguments as
+    keys. Each response is a JSON line with the summaries of the days.
+    The request '{"stats": true}' returns the statistics """
+
+    SERVE_KEYS = ('serve', 'serve_port', 'serve_socket', 'jobs', 'csv', 'plot',
+                  'cache', 'cache_clear', 'optimize', 'calibrate', 'profile', 'profile_stats',
+                  'fleet', 'fleet_chunk', 'aggregate', 'rolling', 'rolling_start',
+                  'load', 'battery_charge', 'battery_discharge', 'battery_start')
+
+    def __init__(self, cache):
+        self.keys = set(vars(parse_arguments([]))) - set(self.SERVE_KEYS)
+        self.cache = cache
+        self.latencies = deque(maxlen = 1000)
+        self.requests = 0
+        self.errors = 0
+
+    def forecast(self, request):
+        unknown = set(request) - self.keys
+        if unknown:
+            return {'errcode': 2, 'error': f'Keys not served "{", ".join(sorted(unknown))}"'}
+
+        try:
+            args = parse_arguments(request2argv(request))
+        except SystemExit:
+            return {'errcode': 2, 'error': 'Invalid arguments'}
+
+        errcode = check_arguments(args)
+        if errcode > 0:
+            return {'errcode': errcode, 'error': 'Arguments out of range'}
+
+        days = get_forecast_days(args)
+        pps = [get_panel_power(args, day, self.cache) for day in days]
+        return {'errcode': 0, 'name': args.panel_name,
+                'days': [pp.get_summary() for pp in pps]}
+
+    def get_stats(self):
+        latencies = np.array(self.latencies) if len(self.latencies) > 0 else np.zeros(1)
+        return {'requests': self.requests,
+                'errors': self.errors,
+                'median_ms': float(np.median(latencies)),
+                'p95_ms': float(np.percentile(latencies, 95)),
+                'max_ms': float(np.max(latencies)),
+                'cache_hits': self.cache.hits,
+                'cache_misses': self.cache.misses,
+                'cache_tracks': len(self.cache.tracks)}
+
+    async def handle(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+
+                begin = time.perf_counter()
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError('Request is no object')
+                except ValueError as e:
+                    request, error = None, f'Invalid JSON: {e}'
+                else:
+                    error = None
+
+                if request is not None and request.get('stats'):
+                    response = self.get_stats()
+                else:
+                    # Every line but the stats is a request, the invalid too
+                    self.requests += 1
+                    if error is not None:
+                        response = {'errcode': 2, 'error': error}
+                    else:
+                        # The forecast must not block other connections
+                        try:
+                            response = await loop.run_in_executor(None, self.forecast, request)
+                        except Exception as e:
+                            # A failed request must not drop the connection
+                            response = {'errcode': 3, 'error': f'The forecast failed: {e}'}
+                        self.latencies.append(1000*(time.perf_counter() - begin))
+                    self.errors += response.get('errcode', 0) > 0
+
+                writer.write((json.dumps(response) + '\n').encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, port = None, socket = None):
+        if socket is not None:
+            server = await asyncio.start_unix_server(self.handle, path = socket)
+        else:
+            server = await asyncio.start_server(self.handle, host = '127.0.0.1', port = port)
+        async with server:
+            await server.serve_forever()
+
+
+def main_serve(args):
+    """ Serves forecasts until interrupted """
+    if args.serve_socket is None and (args.serve_port <= 0 or args.serve_port > 65535):
+        logger.error(f'The port of the server is out of range "{args.serve_port}"')
+        return 23
+
+    where = args.serve_socket if args.serve_socket is not None else f'127.0.0.1:{args.serve_port}'
+    logger.info(f'Serving forecasts on "{where}"')
+
+    # Load the lazy parts once before the first request
+    get_sun_track(args.lat, args.lon, get_day_stamps(args.forecast_day), args.engine)
+
+    server = Forecast_Server(Memory_Sun_Cache())
+    asyncio.run(server.serve(args.serve_port, args.serve_socket))
+    return 0
+
+
 if __name__ == '__main__':
     try:
         err = main()